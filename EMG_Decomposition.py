@@ -1,6 +1,13 @@
 from EMG_classes import offline_EMG
 import os
+import sys
 import numpy as np
+import psutil
+
+try:
+    import resource  # not available on Windows, the peak working set of psutil is used there
+except ImportError:
+    resource = None
 
 
 class EMGDecomposition:
@@ -40,7 +47,7 @@ class EMGDecomposition:
         self.emg_obj = offline_EMG(1, rejected_chan=self.rejected_chan)  # 0/1 filter signal
         self.file = filepath
 
-    def run(self, grid_names=['4-8-L']):
+    def run(self, grid_names=['4-8-L'], signal_dict=None):
         """
         Run the decomposition process for the EMG file.
 
@@ -49,10 +56,18 @@ class EMGDecomposition:
 
         Args:
             grid_name (str, optional): The name of the grid to be used in the decomposition. Defaults to '4-8-L'.
+            signal_dict (dict, optional): Signal dictionary that was loaded before (see reader_files.signal_loader.load_signal_dicts), 
+                the file is then not converted again. Its grids are used instead of grid_names.
         """
+        self.memory_report = {}  # Memory use (MB) after every stage
+        self.report_memory('start')
+
         # File organization and selection
         self.emg_obj.select_file(self.file)  # Select the training file (.mat), composed by ISpin
-        self.emg_obj.convert_poly5_xdf(grid_names=grid_names, muscle_names=['TA'])  # Adds signal_dict to the emg_obj, using Matlab output of ISpin
+        if signal_dict is None:
+            self.emg_obj.convert_poly5_xdf(grid_names=grid_names, muscle_names=['TA'])  # Adds signal_dict to the emg_obj, using Matlab output of ISpin
+        else:
+            self.emg_obj.use_signal_dict(signal_dict)
         print('Data loaded')
         self.emg_obj.grid_formatter()  # Adds spatial context
 
@@ -67,6 +82,7 @@ class EMGDecomposition:
         self.emg_obj.signal_dict['diff_data'] = []  # Placeholder for the differential data
         tracker = 0  # Tracker corresponds to the grid number
         nwins = int(len(self.emg_obj.plateau_coords) / 2)  # Number of force profiles to decompose
+        self.report_memory('batching')
 
         # Loop through grids
         for g in range(int(self.emg_obj.signal_dict['ngrids'])):
@@ -74,34 +90,27 @@ class EMGDecomposition:
                 self.emg_obj.ext_factor / np.shape(self.emg_obj.signal_dict['batched_data'][tracker])[0]
             ))  # Calculate extension factor using #EMG channels
 
-            # Arrays holding extended EMG data PRIOR to removal of edges
-            self.emg_obj.signal_dict['extend_obvs_old'] = np.zeros([
-                nwins,
-                np.shape(self.emg_obj.signal_dict['batched_data'][tracker])[0] * extension_factor,
-                np.shape(self.emg_obj.signal_dict['batched_data'][tracker])[1] + extension_factor - 1 - self.emg_obj.differential_mode
-            ])
-            self.emg_obj.decomp_dict['whitened_obvs_old'] = self.emg_obj.signal_dict['extend_obvs_old'].copy()
+            # Whitening and dewhitening matrices (per interval, filled by convul_sphering) and the inverse of the covariance of 
+            # the extended EMG data (per interval, only filled by get_inv_extend_obvs). The extended EMG data itself is only computed within convul_sphering
+            self.emg_obj.signal_dict['inv_extend_obvs'] = [None] * nwins
+            self.emg_obj.decomp_dict['dewhiten_mat'] = [None] * nwins
+            self.emg_obj.decomp_dict['whiten_mat'] = [None] * nwins
 
-            # Arrays for square and inverse of extended EMG data
-            self.emg_obj.signal_dict['sq_extend_obvs'] = np.zeros([
+            # Whitened extended EMG data AFTER removal of edges, the only data that is used by the fixed point iterations and post-processing
+            start_idx = int(np.round(self.emg_obj.signal_dict['fsamp'] * self.emg_obj.edges2remove) - 1)
+            end_idx = -int(np.round(self.emg_obj.signal_dict['fsamp'] * self.emg_obj.edges2remove))
+            ncols = np.shape(self.emg_obj.signal_dict['batched_data'][tracker])[1] + extension_factor - 1 - self.emg_obj.differential_mode
+            
+            self.emg_obj.decomp_dict['whitened_obvs'] = np.zeros([
                 nwins,
                 np.shape(self.emg_obj.signal_dict['batched_data'][tracker])[0] * extension_factor,
-                np.shape(self.emg_obj.signal_dict['batched_data'][tracker])[0] * extension_factor
+                len(range(ncols)[start_idx:end_idx])
             ])
-            self.emg_obj.signal_dict['inv_extend_obvs'] = self.emg_obj.signal_dict['sq_extend_obvs'].copy()
-
-            # Whitening and dewhitening matrices
-            self.emg_obj.decomp_dict['dewhiten_mat'] = self.emg_obj.signal_dict['sq_extend_obvs'].copy()
-            self.emg_obj.decomp_dict['whiten_mat'] = self.emg_obj.signal_dict['sq_extend_obvs'].copy()
 
-            # Arrays for extended EMG data AFTER removal of edges
-            start_idx = int(np.round(self.emg_obj.signal_dict['fsamp'] * self.emg_obj.edges2remove) - 1)
-            end_idx = -int(np.round(self.emg_obj.signal_dict['fsamp'] * self.emg_obj.edges2remove))
-            
-            self.emg_obj.signal_dict['extend_obvs'] = (
-                self.emg_obj.signal_dict['extend_obvs_old'][:, :, start_idx:end_idx]
-            ).copy()
-            self.emg_obj.decomp_dict['whitened_obvs'] = self.emg_obj.signal_dict['extend_obvs'].copy()
+            # Initialize MU filters, CoVs and SILs of all intervals
+            self.emg_obj.decomp_dict['MU_filters'] = [None] * nwins
+            self.emg_obj.decomp_dict['CoVs'] = [None] * nwins
+            self.emg_obj.decomp_dict['SILs'] = np.zeros([nwins, self.emg_obj.its])
 
             for interval in range(nwins):
                 # Initialize separation matrix B and vector w
@@ -112,18 +121,15 @@ class EMGDecomposition:
                     np.shape(self.emg_obj.decomp_dict['whitened_obvs'][interval])[0], 1
                 ])
 
-                # Initialize MU filters and CoVs
-                self.emg_obj.decomp_dict['MU_filters'] = [None] * nwins
-                self.emg_obj.decomp_dict['CoVs'] = [None] * nwins
-                self.emg_obj.decomp_dict['SILs'] = np.zeros([nwins, self.emg_obj.its])
-
                 # Convolutional Sphering
                 print('Starting convolutional sphering...')
                 self.emg_obj.convul_sphering(g, interval, tracker)#signal extension & whitening
+                self.report_memory(f'convolutional sphering (grid {g}, interval {interval})')
 
                 # Fast ICA
                 print('Starting ICA...')
                 self.emg_obj.fast_ICA_and_CKC(g, interval, tracker)  # Find weight vector using FPA and source improvement
+                self.report_memory(f'ICA (grid {g}, interval {interval})')
 
             # Post-processing for each grid
             self.emg_obj.decomp_dict['pulse_trains'] = [None] * nwins
@@ -132,9 +138,46 @@ class EMGDecomposition:
 
             print('Post-processing...')
             self.emg_obj.post_process_EMG(g, tracker)  # g and tracker are unnecessary here
+            self.report_memory(f'post-processing (grid {g})')
+
+            # The whitened data of this grid is not used anymore once its motor units are found
+            self.emg_obj.decomp_dict['whitened_obvs'] = None
             tracker += 1  # Move to the next grid
 
         # Save results
         print('Saving data...')
         self.emg_obj.save_EMG_decomposition(g, tracker)  # g and tracker are unused in this function
         print('Data saved.')
+        self.report_memory('saving')
+
+    def report_memory(self, stage):
+        """
+        Print the memory use of the process after a stage of the decomposition and store it in memory_report.
+
+        The resident set size is reported with its change since the previous stage, which shows the memory that a stage 
+        keeps (or frees). The cumulative peak is the high-water mark of the whole process, it never decreases.
+
+        Args:
+            stage (str): Name of the stage that just finished.
+        """
+        rss, peak = memory_use()
+        previous = list(self.memory_report.values())[-1]['rss'] if self.memory_report else rss
+        self.memory_report[stage] = dict(rss=rss, change=rss - previous, cumulative_peak=peak)
+        print(f'Memory after {stage}: {rss:.0f} MB ({rss - previous:+.0f} MB), cumulative peak {peak:.0f} MB')
+
+
+def memory_use():
+    """
+    Current and peak resident set size of the process in MB. The peak comes from the resource module (Linux and macOS) 
+    or the peak working set (Windows).
+
+    Returns:
+        tuple: (rss, peak), the current and the cumulative peak memory use in MB.
+    """
+    memory_info = psutil.Process().memory_info()
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / 1024**2 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, kilobytes on Linux
+    else:
+        peak = getattr(memory_info, 'peak_wset', memory_info.rss) / 1024**2
+    return memory_info.rss / 1024**2, peak
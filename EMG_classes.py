@@ -14,6 +14,8 @@ import tkinter as tk
 import gzip 
 from reader_files.xdf_reader import Xdf_Reader
 from reader_files.poly5_force_file_reader import Poly5Reader
+from reader_files.recording_cache import load_cache, save_cache, entry_name
+import hashlib
 # root = tk.Tk()
 np.random.seed(1337)
 
@@ -38,6 +40,10 @@ class EMG():
         self.ext_factor = 1000 # extension of observations for numerical stability 
         self.edges2remove = 0.5 # trimming the batched data, to remove the effects of spectral leakage
         self.plat_thr = 0.01 # giving some padding about the segmentation of the plateau region, if used
+        self.cache = 0 # Boolean to keep the decoded recordings in a sidecar cache, so that decomposing the same file again skips the parsing
+        self.cache_dir = None # directory of the sidecar cache (None = the 'cache' folder of this repository)
+        self.plateau_loading = 1 # Boolean to only decode the EMG of the plateau region(s) for the batches (Poly5 files with reference), the full EMG is decoded when it is needed for saving
+        self.filter_cache = 0 # Boolean to keep the filtered batches in the sidecar cache (cache_dir), so that decomposing the same batches again (e.g. with other ICA settings) skips the filtering
         # post processing
         self.alignMUAP = 0 # Boolean to determine whether we will realign the discharge times with the peak of MUAPs (channel with the MUAP with the highest p2p amplitudes, from double diff EMG signal)
         self.refineMU = 0 # Boolean to determine whether we refine MUs, involve 1) removing outliers (1st time), 2) revaluating the MU pulse trains
@@ -80,6 +86,7 @@ class offline_EMG(EMG):
 
         # create a dictionary containing all relevant signal parameters and data
         signal = dict(data = emg_data, fsamp = fsamp, nchans = nchans, ngrids = ngrids,grids = grid_names[:ngrids],muscles = muscle_names[:ngrids]) # discard the other muscle and grid entries, not relevant
+        signal['nsamples'] = np.shape(emg_data)[1]
 
         # if the signals were recorded with a feedback generated by ISpin, get the target and the path performed by the participant
         if self.ref_exist:
@@ -91,26 +98,41 @@ class offline_EMG(EMG):
         self.signal_dict = signal
         self.decomp_dict = {} # initialising this dictionary here for later use
         self.dict = {} # initialising this dictionary here for later use
+        self.filter_cache_entries = set() # cache entries in use by this decomposition (see filter_batch)
         return
     
     def convert_poly5_xdf(self, grid_names = ['TMSi8-8-L'], muscle_names = ['BB']):
         try:
             if self.filepath_poly5_xdf.lower().endswith('poly5'):
-                data = Poly5Reader(self.filepath_poly5_xdf)
+                # Read the channel names from the header, then only decode the EMG channels (all but the first and 
+                # last three channels) and the reference channels that are used
+                header = Poly5Reader(self.filepath_poly5_xdf, readAll = False)
+                header.close()
+                emg_ch_names = header.ch_names[1:-3]
+                ref_ch_names = ['Force Profile', 'AUX 1-2'] if self.ref_exist else []
+                self.emg_ch_names = emg_ch_names
+                if self.ref_exist and self.plateau_loading:
+                    # Two-pass loading: only the reference channels are read here, batch_w_target decodes the 
+                    # EMG channels of the plateau intervals and the full EMG is decoded when it is needed
+                    data = Poly5Reader(self.filepath_poly5_xdf, channels = ref_ch_names, cache = self.cache, cache_dir = self.cache_dir)
+                    emg_ch_names = []
+                else:
+                    data = Poly5Reader(self.filepath_poly5_xdf, channels = emg_ch_names + ref_ch_names, cache = self.cache, cache_dir = self.cache_dir)
 
                 # Extract the samples and channel names from the Poly5Reader object
                 self.samples = data.samples
                 self.ch_names = data.ch_names
                 self.sample_rate = data.sample_rate
+                self.num_channels = data.num_channels
+                emg_rows = slice(0, len(emg_ch_names))
                 # Conversion to MNE raw array
             elif self.filepath_poly5_xdf.lower().endswith('xdf'):
-                reader = Xdf_Reader(self.filepath_poly5_xdf)
-                data = reader.data[0]
+                # Only the samples, channel names and sample rate are needed, so no MNE objects are created
+                reader = Xdf_Reader(self.filepath_poly5_xdf, cache = self.cache, cache_dir = self.cache_dir, to_mne = False)
                 
-                self.samples = data.get_data()
-                self.ch_names = data.ch_names
-                self.sample_rate = data.info['sfreq']
+                self.samples, self.ch_names, self.sample_rate = reader.data[0]
                 self.num_channels = len(self.ch_names)
+                emg_rows = slice(1, -3)
                 
             elif not self.filepath_poly5_xdf:
                 tk.messagebox.showerror(title='No file selected', message = 'No data file selected.')
@@ -123,33 +145,59 @@ class offline_EMG(EMG):
 
         fsamp = int(self.sample_rate)
         channels = self.ch_names
-        print(channels[1:-3])
-        nchans = len(channels)
+        print(channels[emg_rows] or self.emg_ch_names)
+        nchans = self.num_channels
         ngrids = len(grid_names)
-        # read in the EMG trial data
-        emg_data = self.samples[1:-3,:]
+        # read in the EMG trial data, unless it is only decoded later on (two-pass loading)
+        emg_data = self.samples[emg_rows,:] if channels[emg_rows] else None
         # create a dictionary containing all relevant signal parameters and data
         signal = dict(data = emg_data, fsamp = fsamp, nchans = nchans, ngrids = ngrids,grids = grid_names[:ngrids],muscles = muscle_names[:ngrids]) # discard the other muscle and grid entries, not relevant
+        signal['nsamples'] = np.shape(self.samples)[1]
        
         # if the signals were recorded with a feedback generated by ISpin, get the target and the path performed by the participant
         if self.ref_exist:
             target_ind = channels.index('Force Profile')
-            target = self.samples[target_ind]
+            target = self.samples[target_ind].astype(np.float64) # the reference signals are small, keep them in float64 for the plateau threshold
             path_ind = channels.index('AUX 1-2')
-            path = self.samples[path_ind]
+            path = self.samples[path_ind].astype(np.float64)
             signal['path'] = path
             signal['target'] = target
         self.signal_dict = signal
         self.decomp_dict = {} # initialising this dictionary here for later use
         self.dict = {} # initialising this dictionary here for later use
+        self.filter_cache_entries = set() # cache entries in use by this decomposition (see filter_batch)
         return
+    
+    def load_emg(self, start = 0, stop = None):
+        """ Decode the EMG channels of the Poly5 file, between the start and stop sample """
+        data = Poly5Reader(self.filepath_poly5_xdf, channels = self.emg_ch_names, start = start, stop = stop, cache = self.cache, cache_dir = self.cache_dir)
+        return data.samples
+    
+    def get_emg(self):
+        """ Return the full EMG data, decoding it first if only the plateau intervals were loaded """
+        if self.signal_dict['data'] is None:
+            self.signal_dict['data'] = self.load_emg()
+        return self.signal_dict['data']
+    
+    def use_signal_dict(self, signal):
+        """ Use a signal dictionary that was loaded before (see reader_files.signal_loader.load_signal_dicts) instead of converting the file, 
+        the attributes that convert_poly5_xdf sets are taken from the dictionary """
+        self.select_file(signal['filepath'])
+        self.emg_ch_names = list(signal['ch_names'])
+        self.ch_names = self.emg_ch_names # the reference signals are separate fields of the dictionary
+        self.sample_rate = signal['fsamp']
+        self.num_channels = signal['nchans']
+        self.signal_dict = dict(signal) # the decomposition adds fields, keep the loaded dictionary as it is
+        self.decomp_dict = {} # initialising this dictionary here for later use
+        self.dict = {} # initialising this dictionary here for later use
+        self.filter_cache_entries = set() # cache entries in use by this decomposition (see filter_batch)
         
     def grid_formatter(self):
 
         """ Match up the signals with the grid shape and numbering """
 
         grid_names = self.signal_dict['grids']
-        self.signal_dict['filtered_data'] = np.zeros([np.shape(self.signal_dict['data'])[0],np.shape(self.signal_dict['data'])[1]]) # Filtered data should have same shape
+        self.signal_dict['filtered_data'] = np.zeros([len(self.emg_ch_names) if self.signal_dict['data'] is None else np.shape(self.signal_dict['data'])[0],self.signal_dict['nsamples']]) # Filtered data should have same shape
         # Initialize maps as lists, as more grids may be used for the input 
         ## TODO: test using >1 grids! 
         c_map = [] # initializing amount of columns  
@@ -334,9 +382,9 @@ class offline_EMG(EMG):
         # TO DO: remove the assumption of the top LHC channel needing to be rejected
         self.rejected_channels = self.rejected_channels[:,1:] # get rid of the irrelevant top LHC channel
       
-    def batch_w_target(self): 
-        """use the EMG signal where the target value is higher than the threshold """
-        plateau = np.where(self.signal_dict['target'] >= max(self.signal_dict['target']) * self.plat_thr)[0] # find indices of the plateau threshold
+    def get_plateau_coords(self, target):
+        """find the start and end indices of the windows where the target value is higher than the threshold """
+        plateau = np.where(target >= max(target) * self.plat_thr)[0] # find indices of the plateau threshold
         discontinuity = np.where(np.diff(plateau) > 1)[0] # check if the plateau is reached in succeeding indices 
         if self.windows > 1 and not discontinuity: 
         
@@ -347,8 +395,6 @@ class offline_EMG(EMG):
 
                 batch[i*2] = plateau[0] + i*wind_len + 1
                 batch [(i+1)*2-1] = plateau[0] + (i+1)*wind_len #different than matlab
-
-            self.plateau_coords = batch
             
         elif self.windows >= 1 and discontinuity: #if discontinuity is not empty -> matlab r. 19
             #difference with matlab: self.windows > 1 
@@ -372,18 +418,27 @@ class offline_EMG(EMG):
                 batch[:,(i+1)*2-1] = prebatch[:,0] + (i+1)*wind_len
 
             batch = np.sort(batch.reshape([1, np.shape(batch)[0]*np.shape(batch)[1]]))
-            self.plateau_coords = batch
             
         else:
             # the last option is having only one window and no discontinuity in the plateau; in that case, you leave as is
             batch = [plateau[0],plateau[-1]] 
             print('plateau coordinates', plateau[0], plateau[-1])
-            self.plateau_coords = batch
+        return batch
+
+    def batch_w_target(self): 
+        """use the EMG signal where the target value is higher than the threshold """
+        self.plateau_coords = self.get_plateau_coords(self.signal_dict['target'])
         
         # with the markers for windows and plateau discontinuities, batch the emg data ready for decomposition
         tracker = 0
         n_intervals = (int(len(self.plateau_coords)/2))
         batched_data = [None] * (self.signal_dict['ngrids'] * n_intervals)
+        
+        if self.signal_dict['data'] is None:
+            # second pass of the two-pass loading: only decode the EMG of the plateau intervals
+            interval_data = [self.load_emg(int(self.plateau_coords[interval*2]), int(self.plateau_coords[(interval+1)*2-1])+1) for interval in range(n_intervals)]
+        else:
+            interval_data = [self.signal_dict['data'][:, int(self.plateau_coords[interval*2]):int(self.plateau_coords[(interval+1)*2-1])+1] for interval in range(n_intervals)]
 
         for i in range(int(self.signal_dict['ngrids'])):
             
@@ -392,13 +447,14 @@ class offline_EMG(EMG):
             
             for interval in range(n_intervals):
                 #the data slice is the slice of 1 grid, only where the threshold of the target is reached 
-                data_slice = self.signal_dict['data'][chans_per_grid*(grid-1):grid*chans_per_grid, int(self.plateau_coords[interval*2]):int(self.plateau_coords[(interval+1)*2-1])+1]
+                data_slice = interval_data[interval][chans_per_grid*(grid-1):grid*chans_per_grid, :]
                 rejected_channels_slice = self.rejected_channels[i,:] == 1
-                # Remove rejected channels
-                batched_data[tracker] = np.delete(data_slice, rejected_channels_slice, 0)
+                # Remove rejected channels, the batches are promoted to float64 for the decomposition (filtering, covariance in whiten_emg)
+                batched_data[tracker] = np.delete(data_slice, rejected_channels_slice, 0).astype(np.float64)
                 tracker += 1
 
         self.signal_dict['batched_data'] = batched_data
+        self.batch_coords = np.copy(self.plateau_coords) # plateau coordinates of the batches, before convul_sphering removes the edges
         self.chans_per_grid = chans_per_grid    
 
     def batch_wo_target(self):
@@ -410,9 +466,7 @@ class offline_EMG(EMG):
         
         # only looking at the first half of all EMG channel data
         half_length = int(np.floor(shape[0] / 2))
-        tmp = np.zeros((half_length, shape[1]))
-        for i in range(np.shape(tmp)[0]):
-            tmp[i,:] =  moving_mean1d(abs(self.signal_dict['data'][i,:]),self.signal_dict['fsamp'])
+        tmp = moving_mean1d(np.abs(self.signal_dict['data'][:half_length,:], dtype = np.float64),self.signal_dict['fsamp'], axis = -1)
         
         fake_ref = np.mean(tmp,axis=0)
         self.signal_dict['path'] = fake_ref
@@ -446,10 +500,11 @@ class offline_EMG(EMG):
                 
                 data_slice = self.signal_dict['data'][chans_per_grid*(grid-1):grid*chans_per_grid, int(self.plateau_coords[interval*2]):int(self.plateau_coords[(interval+1)*2-1])+1]
                 rejected_channels_slice = self.rejected_channels[i,:] == 1
-                batched_data[tracker] = np.delete(data_slice, rejected_channels_slice, 0)
+                batched_data[tracker] = np.delete(data_slice, rejected_channels_slice, 0).astype(np.float64)
                 tracker += 1
         
         self.signal_dict['batched_data'] = batched_data
+        self.batch_coords = np.copy(self.plateau_coords) # plateau coordinates of the batches, before convul_sphering removes the edges
         print(batched_data)
 
   
@@ -461,7 +516,7 @@ class offline_EMG(EMG):
         grid = g+1
         if self.to_filter: # adding since will need to avoid this step if doing real-time decomposition + biofeedback, rond ergens af?
             #self.signal_dict['batched_data'][tracker] = notch_filter(self.signal_dict['batched_data'][tracker],self.signal_dict['fsamp'])
-            self.signal_dict['batched_data'][tracker] = bandpass_filter(self.signal_dict['batched_data'][tracker],self.signal_dict['fsamp'],emg_type = self.emg_type)  
+            self.signal_dict['batched_data'][tracker] = self.filter_batch(g,interval,tracker)
             pass
 
         # differentiation - typical EMG generation model treats low amplitude spikes/MUs as noise, which is common across channels so can be cancelled with a first order difference. Useful for high intensities - where cross talk has biggest impact.
@@ -474,19 +529,21 @@ class offline_EMG(EMG):
         # signal extension - increasing the number of channels to 1000
         # Holobar 2007 -  Multichannel Blind Source Separation using Convolutive Kernel Compensation (describes matrix extension)
         extension_factor = int(np.round(self.ext_factor/len(self.signal_dict['batched_data'][tracker])))
-        self.signal_dict['extend_obvs_old'][interval] = extend_emg(self.signal_dict['extend_obvs_old'][interval], self.signal_dict['batched_data'][tracker], extension_factor)
-        self.signal_dict['sq_extend_obvs'][interval] = (self.signal_dict['extend_obvs_old'][interval] @ self.signal_dict['extend_obvs_old'][interval].T) / np.shape(self.signal_dict['extend_obvs_old'][interval])[1]
-        self.signal_dict['inv_extend_obvs'][interval] = np.linalg.pinv(self.signal_dict['sq_extend_obvs'][interval]) # different method of pinv in MATLAB --> SVD vs QR
+        # the extended observation matrix is not stored, ExtendedEMG computes the products with it from the batch itself
+        # it only lives during this function, fast_ICA_and_CKC and post_process_EMG only use the whitened observations
+        eSIG = ExtendedEMG(self.signal_dict['batched_data'][tracker], extension_factor)
         
         # de-mean the extended emg observation matrix
-        self.signal_dict['extend_obvs_old'][interval] = detrend(self.signal_dict['extend_obvs_old'][interval], axis=- 1, type='constant', bp=0)
+        eSIG = eSIG.demean()
         
+        # remove the edges, a view on the columns of eSIG
+        edges = slice(int(np.round(self.signal_dict['fsamp']*self.edges2remove)-1), -int(np.round(self.signal_dict['fsamp']*self.edges2remove)))
+
         # whiten the signal + impose whitened extended observation matrix has a covariance matrix equal to the identity for time lag zero
-        self.decomp_dict['whitened_obvs_old'][interval],self.decomp_dict['whiten_mat'][interval], self.decomp_dict['dewhiten_mat'][interval] = whiten_emg(self.signal_dict['extend_obvs_old'][interval])
-        
-        # remove the edges
-        self.signal_dict['extend_obvs'][interval] = self.signal_dict['extend_obvs_old'][interval][:,int(np.round(self.signal_dict['fsamp']*self.edges2remove)-1):-int(np.round(self.signal_dict['fsamp']*self.edges2remove))]
-        self.decomp_dict['whitened_obvs'][interval] = self.decomp_dict['whitened_obvs_old'][interval][:,int(np.round(self.signal_dict['fsamp']*self.edges2remove)-1):-int(np.round(self.signal_dict['fsamp']*self.edges2remove))]
+        # the covariance is computed over the full batch, only the columns without the edges are whitened
+        # its eigendecomposition gives the whitening and dewhitening matrices and the regularised inverse (see get_inv_extend_obvs)
+        self.decomp_dict['whitened_obvs'][interval],self.decomp_dict['whiten_mat'][interval], self.decomp_dict['dewhiten_mat'][interval] = whiten_emg(eSIG, columns = edges)
+        self.signal_dict['inv_extend_obvs'][interval] = None # computed from the new whitening matrix when it is asked for
         
         if g == 0: # don't need to repeat for every grid, since the path and target info (informing the batches), is the same for all grids
             """find the new plateau coordinates, when the edges are removed"""
@@ -494,6 +551,43 @@ class offline_EMG(EMG):
             self.plateau_coords[(interval+1)*2 - 1] = self.plateau_coords[(interval+1)*2-1]  - int(np.round(self.signal_dict['fsamp']*self.edges2remove))
 
         print('Signal extension and whitening complete')
+    def get_inv_extend_obvs(self,interval):
+
+        """ Regularised inverse of the covariance matrix of the extended observations of an interval, only computed when it is asked for. 
+        It follows from the eigendecomposition of whiten_emg, as whiten_mat @ whiten_mat = evectors @ diag(1/evalues) @ evectors', 
+        with only the eigenvalues above the regularisation limit """
+        if self.signal_dict['inv_extend_obvs'][interval] is None:
+            self.signal_dict['inv_extend_obvs'][interval] = self.decomp_dict['whiten_mat'][interval] @ self.decomp_dict['whiten_mat'][interval]
+        return self.signal_dict['inv_extend_obvs'][interval]
+
+    def filter_batch(self,g,interval,tracker):
+
+        """ Band-pass filter a batch. With filter_cache, the filtered batch is stored in the sidecar cache and read back as a read-only 
+        memory-map when the same batch is filtered again. The cache entry is only valid for the current content of the file, and it is kept 
+        apart from other batches by the rejected channels, the plateau coordinates, the filter settings and the grid and interval. 
+        Storing a batch never evicts the cached samples of the recording or the filtered batches that were used before, which may still be memory-mapped """
+        batch = self.signal_dict['batched_data'][tracker]
+        if not self.filter_cache:
+            return bandpass_filter(batch,self.signal_dict['fsamp'],emg_type = self.emg_type)
+
+        # convul_sphering filters batched_data[tracker] again for every interval, so the interval is part of the key as well
+        params = dict(filter = 'bandpass_sos', fsamp = int(self.signal_dict['fsamp']), emg_type = int(self.emg_type), 
+                      rejected_channels = np.flatnonzero(self.rejected_channels[g,:] == 1).tolist(), 
+                      plateau_coords = np.asarray(self.batch_coords, dtype = float).ravel().tolist(), 
+                      grid = int(g), interval = int(interval), tracker = int(tracker), shape = list(np.shape(batch)))
+        tag = 'filtered_batch_' + hashlib.sha1(json.dumps(params, sort_keys = True).encode('utf-8')).hexdigest()[:16]
+
+        # entries in use: the cached samples and the filtered batches of this decomposition
+        self.filter_cache_entries.add(entry_name(self.filepath_poly5_xdf, self.cache_dir))
+        self.filter_cache_entries.add(entry_name(self.filepath_poly5_xdf, self.cache_dir, tag))
+
+        cached = load_cache(self.filepath_poly5_xdf, self.cache_dir, tag)
+        if cached is not None and cached[1] == params:
+            return cached[0]['batch']
+        filtered_batch = bandpass_filter(batch,self.signal_dict['fsamp'],emg_type = self.emg_type)
+        save_cache(self.filepath_poly5_xdf, dict(batch = filtered_batch), params, cache_dir = self.cache_dir, tag = tag, keep = self.filter_cache_entries)
+        return filtered_batch
+
 ######################### FAST ICA AND CONVOLUTIVE KERNEL COMPENSATION  ############################################
 
     def fast_ICA_and_CKC(self,g,interval,tracker,cf_type = 'skew',ortho_type = 'ord_deflation'):
@@ -504,7 +598,10 @@ class offline_EMG(EMG):
         
         # identify the time instant at which the maximum of the squared summation of all whitened extended observation vectors
         # occurs. Then, projection vector is initialised to the whitened observation vector, at this located time instant.
-        Z = np.array(self.decomp_dict['whitened_obvs'][interval]).copy()
+        # Z is only changed by peel_off, without it the whitened observations are used as they are
+        Z = self.decomp_dict['whitened_obvs'][interval]
+        if self.peel_off == 1:
+            Z = Z.copy()
         sort_sq_sum_Z = np.argsort(np.square(np.sum(Z, axis = 0))) # sort the activity indices (in time)
         time_axis = np.linspace(0,np.shape(Z)[1],np.shape(Z)[1])/self.signal_dict['fsamp']  # create a time axis for spiking activity
 
@@ -623,7 +720,7 @@ class offline_EMG(EMG):
         
         # batch processing over each window
         extension_factor = int(np.round(self.ext_factor/len(self.signal_dict['batched_data'][tracker])))
-        pulse_trains, discharge_times = batch_process_filters(self.decomp_dict['MU_filters'], self.decomp_dict['whitened_obvs'], self.plateau_coords, extension_factor, self.differential_mode,np.size(self.signal_dict['data'][1]),self.signal_dict['fsamp'])
+        pulse_trains, discharge_times = batch_process_filters(self.decomp_dict['MU_filters'], self.decomp_dict['whitened_obvs'], self.plateau_coords, extension_factor, self.differential_mode,self.signal_dict['nsamples'],self.signal_dict['fsamp'])
         
         # realign the discharge times with the centre of the MUAP
         if self.alignMUAP:
@@ -647,7 +744,7 @@ class offline_EMG(EMG):
                 
                 # Re-evaluate all of the UNIQUE MUs over the contraction
                 # TODO: adjust to have adding of length(signal.EMGmask{i}), :) --> generalises to cases where the upper left electrode is not excluded
-                self.decomp_dict['pulse_trains'][g], discharge_times_new = refine_mus(self.signal_dict['data'][self.chans_per_grid*(g):self.chans_per_grid*(g) + len(self.rejected_channels[g]),:], self.rejected_channels[g], pulse_trains, discharge_times_new, self.signal_dict['fsamp'])
+                self.decomp_dict['pulse_trains'][g], discharge_times_new = refine_mus(self.get_emg()[self.chans_per_grid*(g):self.chans_per_grid*(g) + len(self.rejected_channels[g]),:], self.rejected_channels[g], pulse_trains, discharge_times_new, self.signal_dict['fsamp'])
                 
                 # Remove outliers generating irrelevant discharge rates before manual edition (2nd time)
                 discharge_times_new = remove_outliers(pulse_trains, discharge_times_new, self.CoVDR, self.signal_dict['fsamp'])
@@ -655,7 +752,7 @@ class offline_EMG(EMG):
                 self.decomp_dict['pulse_trains'][g] = pulse_trains #make placeholder for it? 
 
             # generate binary spike trains (only containing 0/1) using the discharge times and the length of the data 
-            binary_spike_trains = get_binary_pulse_trains(discharge_times_new, np.size(self.signal_dict['data'][1]))
+            binary_spike_trains = get_binary_pulse_trains(discharge_times_new, self.signal_dict['nsamples'])
             
             self.decomp_dict['discharge_times'][g] = discharge_times_new
             self.decomp_dict['SILs'] = [None] * np.shape(self.decomp_dict['pulse_trains'][g])[0] #placeholder 
@@ -663,7 +760,7 @@ class offline_EMG(EMG):
             self.discharge_times = discharge_times_new
             self.mu_filters = MU_filters_new
             
-            Z = np.array(self.decomp_dict['whitened_obvs'][0]).copy()
+            Z = self.decomp_dict['whitened_obvs'][0]
             
             # store the final SILs for analysis in OpenHDEMG
             for i in range((np.shape(self.decomp_dict['MU_filters'][0]))[1]):
@@ -684,7 +781,7 @@ class offline_EMG(EMG):
         self.file_path_json = os.path.join(self.savefolder, self.filename +'_decomp.json')
         self.dict["SOURCE"] = "CUSTOMCSV"
         self.dict["FILENAME"] = "training40" 
-        raw_emg = sort_raw_emg(self.signal_dict['data'],  self.signal_dict['grids'][0], self.signal_dict['fsamp'], self.emg_type)
+        raw_emg = sort_raw_emg(self.get_emg(),  self.signal_dict['grids'][0], self.signal_dict['fsamp'], self.emg_type)
         self.dict["RAW_SIGNAL"] = pd.DataFrame(raw_emg).T
         self.dict["REF_SIGNAL"] = pd.DataFrame(self.signal_dict['path'])
         self.dict["ACCURACY"] = pd.DataFrame(self.decomp_dict['SILs'])
@@ -693,7 +790,7 @@ class offline_EMG(EMG):
         self.dict["FSAMP"] = float(self.signal_dict['fsamp'])
         self.dict["IED"] = float(self.ied)
         self.dict["BINARY_MUS_FIRING"] = pd.DataFrame(self.dict['BINARY_MUS_FIRING']).T
-        self.dict["EMG_LENGTH"] = self.signal_dict['data'].shape[1]
+        self.dict["EMG_LENGTH"] = self.signal_dict['nsamples']
         self.dict["NUMBER_OF_MUS"] = np.shape(self.decomp_dict['pulse_trains'][0])[0]
         self.dict["EXTRAS"] = pd.DataFrame(columns=[0])
         
@@ -13,11 +13,12 @@ import json
 import os
 from copy import deepcopy
 import gzip
+import threading
 from sklearn.cluster import KMeans
 
 from openhdemg.library.mathtools import compute_sil
 from openhdemg.library.plotemg import showgoodlayout
-from processing_tools import get_binary_pulse_trains, whiteesig, extend_emg, pcaesig, detect_peaks, maxk, bandpass_filter
+from processing_tools import get_binary_pulse_trains, whiteesig, ExtendedEMG, pcaesig, detect_peaks, maxk, bandpass_filter
 
 class EditMU:
     """
@@ -79,6 +80,11 @@ class EditMU:
         self.sil_recalculated = [False] * len(emgfile['MUPULSES'])
         self.edge_margin = round(0.1*self.fsamp)
 
+        # Filter the full raw signal once in a background thread, the recalculations slice the filtered signal
+        self.filtered_signal = None
+        self.prefilter_thread = threading.Thread(target=self.prefilter_raw_signal, daemon=True)
+        self.prefilter_thread.start()
+
         # Calculate SIL values for each motor unit
         self.sil_old = np.zeros(len(emgfile['MUPULSES']))
         for i in range(len(emgfile["IPTS"].columns)):
@@ -854,6 +860,9 @@ class EditMU:
 
         # Recalculate the pulse train
         Pt, spikes = self.recalc_pulse_train()
+        if Pt is None:
+            self.btn_recalc.color = self.button_color
+            return
 
         # Recalculate peaks based on the new pulse train
         self.recalc_peaks(Pt, spikes)
@@ -884,7 +893,8 @@ class EditMU:
         5. Updates the IPTS with the recalculated pulse train.
 
         Returns:
-            np.ndarray: Array of detected spikes based on the recalculated pulse train.
+            np.ndarray: Array of detected spikes based on the recalculated pulse train, 
+            (None, None) if the current window holds no samples.
         """
 
         # Get the current window's limits
@@ -895,20 +905,21 @@ class EditMU:
         # Find the indices within the given range
         idx = self.ipts.index[(self.ipts.index >= graphstart) & (self.ipts.index <= graphend)].to_numpy()
 
-        # Get emg data and filter
-        emg = self.emgfile["RAW_SIGNAL"].iloc[idx].to_numpy().T
-        emg = bandpass_filter(emg, self.fsamp,emg_type = 0)
+        # Check if the window holds samples of the pulse train
+        if len(idx) == 0:
+            print('No samples in the current window, please move the window to the pulse train')
+            return None, None
+
+        # Get the filtered emg data of the window
+        emg = self.get_filtered_signal()[:, idx[0]:idx[-1] + 1]
 
         # Determine extension factor
         ext_factor = 1000
         extension_factor =  round(np.round(ext_factor / len(emg)))
 
-        # Extend EMG signal
-        self.emgfile['extend_obvs_old'] = np.zeros([# Set template
-            1, np.shape(emg)[0] * extension_factor, np.shape(emg)[1] + extension_factor - 1
-        ])
-        eSIG = extend_emg(self.emgfile['extend_obvs_old'][0], emg, extension_factor) # Actual extension of signal
-        ReSIG = np.matmul(eSIG, eSIG.T) / len(eSIG)
+        # Extend EMG signal, the extended signal is not stored but computed from emg in the products below
+        eSIG = ExtendedEMG(emg, extension_factor)
+        ReSIG = eSIG.gram() / len(eSIG) # block-Toeplitz, from the lagged cross-correlations of emg
         iReSIGt = np.linalg.pinv(ReSIG)
 
         # Perform PCA on extended signal
@@ -957,6 +968,30 @@ class EditMU:
         self.ipts[self.current_index] = self.emgfile["IPTS"][self.current_index]
         return Pt, spikes
 
+    def prefilter_raw_signal(self):
+        """
+        Band-pass filter the full raw EMG signal, as used for recalculating the pulse trains.
+
+        The whole recording is filtered at once, so the filter transients only occur at the start and
+        end of the recording instead of at the edges of every recalculated window. The filtered signal
+        is stored as a contiguous float32 (channels x samples) array.
+        """
+        raw_signal = np.asarray(self.emgfile["RAW_SIGNAL"], dtype=np.float64).T
+        self.filtered_signal = np.ascontiguousarray(bandpass_filter(raw_signal, self.fsamp, emg_type=0), dtype=np.float32)
+
+    def get_filtered_signal(self):
+        """
+        Return the filtered raw EMG signal, waiting for the background filtering to finish if needed.
+
+        Returns:
+            np.ndarray: Filtered EMG signal (channels x samples, float32).
+        """
+        self.prefilter_thread.join()
+        if self.filtered_signal is None:
+            # The background filtering failed, filter in this thread to show the error
+            self.prefilter_raw_signal()
+        return self.filtered_signal
+
     def recalc_peaks(self, Pt, spikes):
         """
         Recalculate peaks by applying k-means clustering and removing outliers.
@@ -0,0 +1,227 @@
+import numpy as np
+import matplotlib.pyplot as plt
+
+PREVIEW_BIN_SIZE = 16 # number of samples per bin in the finest level of the envelope pyramid
+PREVIEW_LEVEL_FACTOR = 4 # number of bins of a level that are merged into one bin of the next level
+PREVIEW_CHUNK_SIZE = PREVIEW_BIN_SIZE * 8192 # number of samples that are read at once to build the pyramid
+
+class RawEMGPreview:
+    """
+    A lightweight viewer of raw EMG recordings to select the channels that are rejected before decomposition.
+
+    Instead of loading the full recording into an MNE object, the samples are streamed once from the
+    (memory-mapped) reader to build a min/max envelope pyramid per channel: the finest level holds the
+    minimum and maximum of every PREVIEW_BIN_SIZE samples, every next level merges PREVIEW_LEVEL_FACTOR bins.
+    Only the visible time range is drawn, from the coarsest level that still has at least one bin per pixel,
+    or from the raw samples when zoomed in further. So drawing costs about the same for a short or a long recording.
+
+    As in the MNE browser, only connected channels (channels that are not all-zero) are shown, and clicking on
+    the name or the trace of a channel toggles it between selected and rejected.
+
+    Args:
+        data (Poly5Reader): Reader of the recording, preferably opened with mode='mmap'.
+        title (str): Title of the window.
+        scaling (float): Amplitude (in Volt) that corresponds to half the distance between two channels.
+        duration (float): Initial visible time range in seconds.
+        n_channels (int): Number of channels that are shown at once.
+    """
+
+    def __init__(self, data, title=None, scaling=250e-6, duration=5, n_channels=5):
+        self.data = data
+        self.fs = data.sample_rate
+        self.num_samples = data.samples.shape[1]
+        self.title = title
+        self.duration = min(duration, self.num_samples / self.fs)
+        self.n_channels = n_channels
+
+        # Channels in Volt are shown with the same scaling, other channels as they are (as the MNE scaling of misc channels)
+        units = data.ch_units # in the order of the (grid-reordered) rows of samples
+        unit_scale = np.array([1e-6 if (u == "µVolt" or u == "uVolt" or u == '\u03BCVolt') else 1 for u in units])
+        self.gain = np.array([unit_scale[i] / scaling if 'V' in units[i] else 1 for i in range(len(units))]) / 2
+
+        # Build the envelope pyramid and only keep the connected channels
+        connected, self.levels = self.build_pyramid(data.samples)
+        self.channels = np.flatnonzero(connected)
+        self.ch_names = [data.ch_names[idx] for idx in self.channels]
+        self.levels = [(mins[self.channels], maxs[self.channels]) for mins, maxs in self.levels]
+        self.rejected = []
+
+        self.start = 0
+        self.first_channel = 0
+
+    @staticmethod
+    def build_pyramid(samples):
+        """
+        Compute the min/max envelope pyramid of all channels in a single pass over the samples.
+
+        Returns:
+            connected (np.ndarray): Boolean per channel, True if the channel has any nonzero sample.
+            levels (list): Per level a tuple (mins, maxs) of (channels x bins) float32 arrays. Level k has
+                bins of PREVIEW_BIN_SIZE * PREVIEW_LEVEL_FACTOR**k samples, the last bin may be shorter.
+        """
+        n_ch, n_samples = samples.shape
+        n_bins = -(-n_samples // PREVIEW_BIN_SIZE)
+        mins = np.zeros((n_ch, n_bins), dtype=np.float32)
+        maxs = np.zeros((n_ch, n_bins), dtype=np.float32)
+        connected = np.zeros(n_ch, dtype=bool)
+
+        # The chunk size is a multiple of the bin size, so only the last chunk can end with a partial bin
+        for start in range(0, n_samples, PREVIEW_CHUNK_SIZE):
+            chunk = np.asarray(samples[:, start:start + PREVIEW_CHUNK_SIZE])
+            connected |= (chunk != 0).any(axis=1)
+            first_bin = start // PREVIEW_BIN_SIZE
+            chunk_mins, chunk_maxs = _bin_min_max(chunk, chunk, PREVIEW_BIN_SIZE)
+            mins[:, first_bin:first_bin + chunk_mins.shape[1]] = chunk_mins
+            maxs[:, first_bin:first_bin + chunk_maxs.shape[1]] = chunk_maxs
+
+        levels = [(mins, maxs)]
+        while mins.shape[1] > 1:
+            mins, maxs = _bin_min_max(mins, maxs, PREVIEW_LEVEL_FACTOR)
+            levels.append((mins, maxs))
+        return connected, levels
+
+    def show(self):
+        """
+        Open the preview and block until the window is closed.
+
+        Returns:
+            list: Names of the rejected channels, in the order in which they were rejected.
+        """
+        self.fig, self.ax = plt.subplots(num=self.title)
+        self.fig.subplots_adjust(left=0.12, right=0.98, top=0.92, bottom=0.12)
+        self.fig.canvas.mpl_connect("key_press_event", self.on_key)
+        self.fig.canvas.mpl_connect("pick_event", self.on_pick)
+        self.fig.canvas.mpl_connect("resize_event", lambda event: self.draw())
+        if self.title is not None:
+            self.ax.set_title(self.title, fontsize=10)
+        self.add_instructions()
+        self.draw()
+        plt.show(block=True)
+        return self.rejected
+
+    def draw(self):
+        """
+        Draw the visible channels in the visible time range at the resolution of the axes.
+        """
+        self.ax.cla()
+        if self.title is not None:
+            self.ax.set_title(self.title, fontsize=10)
+
+        visible = int(round(self.duration * self.fs))
+        stop = min(self.start + visible, self.num_samples)
+        width = max(int(self.ax.get_window_extent().width), 1)
+        channels = range(self.first_channel, min(self.first_channel + self.n_channels, len(self.channels)))
+
+        self.traces = {}
+        for row, ch in enumerate(channels):
+            x, y = self.get_trace(ch, self.start, stop, width)
+            color = 'lightgray' if self.ch_names[ch] in self.rejected else 'black'
+            line, = self.ax.plot(x / self.fs, y * self.gain[self.channels[ch]] - row, color=color, linewidth=0.5, picker=True, pickradius=3)
+            self.traces[line] = ch
+
+        self.ax.set_xlim(self.start / self.fs, self.start / self.fs + self.duration)
+        self.ax.set_ylim(-len(channels) + 0.5, 0.5)
+        self.ax.set_yticks(-np.arange(len(channels)))
+        self.ax.set_yticklabels([self.ch_names[ch] for ch in channels])
+        for label, ch in zip(self.ax.get_yticklabels(), channels):
+            label.set_picker(True)
+            label.set_color('lightgray' if self.ch_names[ch] in self.rejected else 'black')
+            self.traces[label] = ch
+        self.ax.set_xlabel('Time (s)')
+        self.fig.canvas.draw_idle()
+
+    def get_trace(self, ch, start, stop, width):
+        """
+        Get the samples of a channel between start and stop with about two points per pixel.
+
+        The coarsest level with at least one bin per pixel is used, the minimum and maximum of each bin are
+        interleaved so that the envelope looks the same as the full trace. When a pixel holds less than
+        PREVIEW_BIN_SIZE samples, the raw samples are read from the reader.
+
+        Returns:
+            x (np.ndarray): Sample index of every point.
+            y (np.ndarray): Value of every point.
+        """
+        samples_per_pixel = (stop - start) / width
+        if samples_per_pixel < PREVIEW_BIN_SIZE:
+            y = np.asarray(self.data.samples[self.channels[ch], start:stop], dtype=np.float64)
+            return np.arange(start, stop), y
+
+        level = int(np.log(samples_per_pixel / PREVIEW_BIN_SIZE) // np.log(PREVIEW_LEVEL_FACTOR))
+        level = min(level, len(self.levels) - 1)
+        bin_size = PREVIEW_BIN_SIZE * PREVIEW_LEVEL_FACTOR ** level
+        mins, maxs = self.levels[level]
+        first_bin, last_bin = start // bin_size, -(-stop // bin_size)
+        x = np.repeat(np.arange(first_bin, last_bin) * bin_size, 2)
+        y = np.empty(len(x))
+        y[0::2] = mins[ch, first_bin:last_bin]
+        y[1::2] = maxs[ch, first_bin:last_bin]
+        return x, y
+
+    def on_pick(self, event):
+        """
+        Toggle a channel between selected and rejected when its name or trace is clicked.
+        """
+        ch = self.traces.get(event.artist)
+        if ch is None:
+            return
+        self.toggle_channel(self.ch_names[ch])
+        self.draw()
+
+    def toggle_channel(self, name):
+        """
+        Reject a selected channel or select a rejected channel.
+        """
+        if name in self.rejected:
+            self.rejected.remove(name)
+        else:
+            self.rejected.append(name)
+
+    def on_key(self, event):
+        """
+        Handle key press events for navigation and zooming.
+
+        This method allows for:
+        1. Scrolling through time ('left' and 'right' arrow keys).
+        2. Scrolling through the channels ('up' and 'down' arrow keys).
+        3. Zooming in and out ('+' and '-').
+        """
+        visible = int(round(self.duration * self.fs))
+        if event.key == "right":
+            self.start = max(min(self.start + visible, self.num_samples - visible), 0)
+        elif event.key == "left":
+            self.start = max(self.start - visible, 0)
+        elif event.key == "down":
+            if self.first_channel + self.n_channels < len(self.channels):
+                self.first_channel += self.n_channels
+        elif event.key == "up":
+            self.first_channel = max(self.first_channel - self.n_channels, 0)
+        elif event.key in ("+", "="):
+            self.duration = max(self.duration / 2, 10 / self.fs)
+        elif event.key == "-":
+            self.duration = min(self.duration * 2, self.num_samples / self.fs)
+            self.start = max(min(self.start, self.num_samples - int(round(self.duration * self.fs))), 0)
+        else:
+            return
+        self.draw()
+
+    def add_instructions(self):
+        """
+        Add instructions for navigating and rejecting channels below the plot.
+        """
+        instructions = (
+            "Left/Right Arrow Keys: Scroll through time    Up/Down Arrow Keys: Scroll through channels    "
+            "+/-: Zoom in/out    Click on a channel name or trace: Reject/select channel"
+        )
+        self.fig.text(0.5, 0.01, instructions, horizontalalignment="center", fontsize=9)
+
+
+def _bin_min_max(mins, maxs, bin_size):
+    # Minimum and maximum per bin of bin_size columns, the last bin holds the remaining columns
+    n_full = mins.shape[1] // bin_size
+    full_mins = mins[:, :n_full * bin_size].reshape(mins.shape[0], n_full, bin_size).min(axis=2)
+    full_maxs = maxs[:, :n_full * bin_size].reshape(maxs.shape[0], n_full, bin_size).max(axis=2)
+    if mins.shape[1] > n_full * bin_size:
+        full_mins = np.hstack((full_mins, mins[:, n_full * bin_size:].min(axis=1, keepdims=True)))
+        full_maxs = np.hstack((full_maxs, maxs[:, n_full * bin_size:].max(axis=1, keepdims=True)))
+    return full_mins.astype(np.float32), full_maxs.astype(np.float32)
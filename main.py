@@ -25,6 +25,7 @@ sys.path.append(MODULES_DIR)  # Add modules directory to system path for importi
 from processing_tools import emg_from_json
 from EMG_Decomposition import EMGDecomposition
 from EditMU import EditMU
+from RawEMGPreview import RawEMGPreview
 from reader_files.poly5reader import Poly5Reader
 
 # Define the mode: 'decompose' or 'edit'
@@ -32,6 +33,9 @@ MODE = 'edit'  # Choose either 'decompose' for .poly5 files or 'edit' for pre-de
 
 GRID_NAMES = ['4-8-L']  # If ngrids > 1, fill in ['name_grid1', 'name_grid2', etc...]
 
+# Define the viewer for rejecting channels: 'preview' or 'mne'
+RAW_EMG_VIEWER = 'preview'  # Choose 'preview' for the fast min/max envelope viewer or 'mne' for the MNE browser
+
 def main():
     """
     Main function to handle the EMG data processing workflow.
@@ -79,6 +83,24 @@ def display_raw_emg(filepath):
     """
     Function to read and display raw EMG data from the selected file.
     Only connected channels are displayed to avoid unnecessary noise.
+    Returns the names of the rejected channels.
+    """
+    if RAW_EMG_VIEWER == 'mne':
+        return display_raw_emg_mne(filepath)
+
+    # Memory-map the Poly5 data file, the preview only reads the samples it needs
+    data = Poly5Reader(filepath, mode='mmap')
+
+    # Build the min/max envelope of all channels, unconnected channels (all-zero signals) are left out
+    preview = RawEMGPreview(data, title=filepath, scaling=250e-6, duration=5, n_channels=5)
+
+    print('Click on the names of channels you want to reject, channels turn grey when de-selected')
+    return preview.show()
+
+def display_raw_emg_mne(filepath):
+    """
+    Function to read and display raw EMG data from the selected file in the MNE browser.
+    Only connected channels are displayed to avoid unnecessary noise.
     """
 
     # Read the Poly5 data file
@@ -87,10 +109,7 @@ def display_raw_emg(filepath):
 
     # Filter out unconnected channels (those with all-zero signals)
     print('Click on the names of channels you want to reject, channels turn transparent when de-selected')
-    show_chs = []
-    for idx, ch in enumerate(mne_object.get_data()):
-        if ch.any():
-            show_chs = np.hstack((show_chs, mne_object.info['ch_names'][idx]))
+    show_chs = [name for name, ch in zip(mne_object.info['ch_names'], mne_object.get_data()) if ch.any()]
 
     # Pick only the channels to display
     data_object = mne_object.pick(show_chs)
@@ -1,5 +1,6 @@
 import numpy as np
 import scipy
+import scipy.ndimage
 import pandas as pd
 from numpy import linalg
 from scipy.fft import fft
@@ -11,6 +12,7 @@ import numba
 from sklearn.decomposition import IncrementalPCA
 from numba import jit
 import json, gzip, warnings
+from concurrent.futures import ThreadPoolExecutor
 
 ##################################### FILTERING TOOLS #######################################################
 
@@ -19,74 +21,87 @@ def notch_filter(signal,fsamp,to_han = False):
     """ Implementation of a notch filter, where the frequencies of the line interferences are unknown. Therefore, interference is defined
     as frequency components with magnitudes greater than 5 stds away from the median frequency component magnitude in a window of the signal
     - assuming you will iterate this function over each grid 
+    All channels are processed at once: the spectra are computed with a single rfft, the statistics per window of fsamp frequency bins
+    on the reshaped magnitudes and the notch bandwidth is applied by dilating the boolean mask of interference bins
     """
 
-    bandwidth_as_index = round(4/(fsamp/np.shape(signal)[1]))
+    signal = np.asarray(signal, dtype = np.float64)
+    n_samples = np.shape(signal)[-1]
+    window = int(fsamp)
+    bandwidth_as_index = round(4/(fsamp/n_samples))
     # bandwidth_as_index = int(round(4*(np.shape(signal)[1]/fsamp)))
     # width of the notch filter's effect, when you intend for it to span 4Hz, but converting to indices using the frequency resolution of FT
-    filtered_signal = np.zeros([np.shape(signal)[0],np.shape(signal)[1]])
+    half_bandwidth = int(np.floor(bandwidth_as_index/2))
 
-    for chan in range(np.shape(signal)[0]):
-
-        if to_han:
-            hwindow = scipy.signal.hann(np.shape(signal[chan,:])[0])
-            final_signal = signal[chan,:]* hwindow
-        else:
-            final_signal = signal[chan,:]
-
-        fourier_signal = np.fft.fft(final_signal)
-        fourier_interf = np.zeros(len(fourier_signal),dtype = 'complex_')
-        interf2remove = np.zeros(len(fourier_signal),dtype=int)
-        
-        #create a copy of interf2remove, with instead of zeros NaNs 
-        interf2remove2 = np.empty(len(fourier_signal)) 
-        interf2remove2[:] = np.nan
-        
-        window = fsamp
-        tracker = 0
-    
-        for interval in range(0,len(fourier_signal)-window + 1,window): # so the last interval will start at len(fourier_emg) - window
-            median_freq = np.median(abs(fourier_signal[interval+1:interval+window+1])) 
-            std_freq = np.std(abs(fourier_signal[interval+1:interval+window+1]), ddof = 1) #ddof to 1 to get Matlab results 
-            
-            # interference is defined as when the magnitude of a given frequency component in the fourier spectrum
-            # is greater than 5 times the std, relative to the median magnitude
-            label_interf = list(np.where(abs(fourier_signal[interval+1:interval+window+1]) > median_freq+5*std_freq)[0]) # np.where gives tuple, element access to the array
-            # need to shift these labels to make sure they are not relative to the window only, but to the whole signal
-            label_interf = [x + interval + 1 for x in label_interf] # + 1 since the interval starts with 0? -> 
-    
-            if label_interf: # if a list exists
-                for i in range(int(-np.floor(bandwidth_as_index/2)),int(np.floor(bandwidth_as_index/2)+1)): # so as to include np.floor(bandwidth_as_index/2)
-                    temp_shifted_list = [x + i for x in label_interf]
-                    interf2remove[tracker: tracker + len(label_interf)] = temp_shifted_list
-                    interf2remove2[tracker: tracker + len(label_interf)] = temp_shifted_list
-                    tracker = tracker + len(label_interf)
-        
-        # we only take the first half of the signal, we need a compensatory step for the second half given we haven't wrapped the FT yet
-        # use interf2remove2 instead of interf2remove, as interf2remove is initialized using 0's, this comparison cannot be made! 
-        # interfremove2 is utilized here, as other wise the indices don't equal the matlab version (matlab has +1, so everything is 1 index lower here
-        # results in some 0 indices in the matrix, which are already used in the placeholder!
-        #TODO: make this more elegant!!
-        indexf2remove = np.where(np.logical_and(interf2remove2 >= 0 , interf2remove2 < (len(fourier_signal)/2+1)))[0]
-
-        # use interf2remove here, as interf2remove2 contains floating numbers which cannot be used for indexing 
-        fourier_interf[interf2remove[indexf2remove]] = fourier_signal[interf2remove[indexf2remove]]
-        corrector = int(len(fourier_signal) - np.floor(len(fourier_signal)/2)*2)  # will either be 0 or 1 (0 if signal length is even, 1 if signal length is odd)
-        # wrapping FT
-        fourier_interf[int(np.ceil(len(fourier_signal)/2)):] = np.flip(np.conj(fourier_interf[1: int(np.ceil(len(fourier_signal)/2)+1- corrector)])) # not indexing first because this is 0Hz, not to be repeated
-        filtered_signal[chan,:] = signal[chan,:] - np.fft.ifft(fourier_interf).real
-      
+    if to_han:
+        final_signal = signal * scipy.signal.windows.hann(n_samples)
+    else:
+        final_signal = signal
+
+    # the spectrum of a real signal is symmetric, so the magnitudes of the full spectrum (as np.fft.fft) follow from the first half
+    fourier_signal = np.fft.rfft(final_signal, axis = -1)
+    n_half = np.shape(fourier_signal)[-1]
+    magnitude = np.abs(fourier_signal)
+    magnitude = np.concatenate((magnitude, np.flip(magnitude[..., 1:n_samples - n_half + 1], axis = -1)), axis = -1)
+
+    # windows of fsamp bins start at bin 1 (0 Hz is skipped), the last window is one bin shorter if it would pass the end of the spectrum
+    # interference is defined as when the magnitude of a given frequency component in the fourier spectrum
+    # is greater than 5 times the std, relative to the median magnitude
+    interf = np.zeros(np.shape(magnitude), dtype = bool)
+    n_windows = n_samples // window
+    n_full = n_windows if n_windows*window < n_samples else n_windows - 1
+    if n_full > 0:
+        windowed = magnitude[..., 1:n_full*window + 1].reshape(np.shape(magnitude)[:-1] + (n_full, window))
+        median_freq = np.median(windowed, axis = -1, keepdims = True)
+        std_freq = np.std(windowed, axis = -1, ddof = 1, keepdims = True) #ddof to 1 to get Matlab results 
+        interf[..., 1:n_full*window + 1] = (windowed > median_freq + 5*std_freq).reshape(np.shape(magnitude)[:-1] + (n_full*window,))
+    if n_full < n_windows:
+        last = magnitude[..., n_full*window + 1:]
+        median_freq = np.median(last, axis = -1, keepdims = True)
+        std_freq = np.std(last, axis = -1, ddof = 1, keepdims = True)
+        interf[..., n_full*window + 1:] = last > median_freq + 5*std_freq
+
+    # every interference bin removes the bins within half the bandwidth around it. Only the first half of the spectrum is kept,
+    # the second half follows from the symmetry when transforming back
+    interf = scipy.ndimage.maximum_filter1d(interf.view(np.uint8), 2*half_bandwidth + 1, axis = -1, mode = 'constant', cval = 0)
+    fourier_interf = np.where(interf[..., :n_half].astype(bool), fourier_signal, 0)
+
+    filtered_signal = signal - np.fft.irfft(fourier_interf, n = n_samples, axis = -1)
 
     return filtered_signal
 
-def bandpass_filter(signal,fsamp, emg_type = 'surface'):
+def bandpass_filter(signal,fsamp, emg_type = 'surface', n_jobs = 1):
 
-    """ Generic band-pass filter implementation and application to EMG signal  - assuming that you will iterate this function over each grid """
+    """ Generic band-pass filter implementation and application to EMG signal  - assuming that you will iterate this function over each grid 
+    The filter is applied to all channels (rows) at once, as second-order sections. With n_jobs > 1, the channels are split in n_jobs 
+    chunks that are filtered in parallel threads (scipy releases the GIL while filtering) """
 
     """IMPORTANT!!! There is a difference in the default padding length between Python and MATLAB. For MATLAB -> 3*(max(len(a), len(b)) - 1),
     for Python scipy -> 3*max(len(a), len(b)). So I manually adjusted the Python filtfilt to pad by the same amount as in MATLAB, if you don't the results will not match across
     lanugages. NOTE OF CHIARA GIBBS """   
 
+    sos, order = bandpass_sos(fsamp, emg_type)
+    # the (b,a) form of a bandpass filter of this order has len(b) = len(a) = 2*order + 1, so the MATLAB padding is 3*2*order
+    padlen = 3*2*order
+
+    signal = np.asarray(signal, dtype = np.float64)
+    if n_jobs <= 1 or np.ndim(signal) < 2 or np.shape(signal)[0] < 2:
+        return scipy.signal.sosfiltfilt(sos, signal, axis = -1, padtype = 'odd', padlen = padlen)
+
+    # construct and apply filter per chunk of channels
+    filtered_signal = np.empty(np.shape(signal))
+    def filter_chunk(chans):
+        filtered_signal[chans] = scipy.signal.sosfiltfilt(sos, signal[chans], axis = -1, padtype = 'odd', padlen = padlen)
+    chunks = np.array_split(np.arange(np.shape(signal)[0]), min(n_jobs, np.shape(signal)[0]))
+    with ThreadPoolExecutor(max_workers = n_jobs) as pool:
+        list(pool.map(filter_chunk, [slice(chans[0], chans[-1] + 1) for chans in chunks]))
+    
+    return filtered_signal
+
+def bandpass_sos(fsamp, emg_type = 'surface'):
+
+    """ Coefficients of the band-pass filter of bandpass_filter and StreamingFilter as second-order sections, returns the sections and the filter order """
+
     if emg_type == 0:
         lowfreq = 20
         highfreq = 500
@@ -100,53 +115,83 @@ def bandpass_filter(signal,fsamp, emg_type = 'surface'):
     nyq = fsamp/2
     lowcut = lowfreq/nyq
     highcut = highfreq/nyq
-    [b,a] = scipy.signal.butter(order, [lowcut,highcut],'bandpass') # the cut off frequencies should be inputted as normalised angular frequencies
+    sos = scipy.signal.butter(order, [lowcut,highcut],'bandpass', output = 'sos') # the cut off frequencies should be inputted as normalised angular frequencies
 
-    filtered_signal = np.zeros([np.shape(signal)[0],np.shape(signal)[1]])
-    # construct and apply filter
-    for chan in range(np.shape(signal)[0]):
-        
-        filtered_signal[chan,:] = scipy.signal.filtfilt(b,a,signal[chan,:],padtype = 'odd', padlen=3*(max(len(b),len(a))-1))
-    
-    return filtered_signal
-
-def moving_mean1d(v,w):
-    """ Moving average filter that replicates the method of movmean in MATLAB
-    v is a 1 dimensional vector to be filtered via a moving average
-    w is the window length of this filter """
-
-    u = v.copy()
-    w_temp = w
-    n = len(v)-1
-
-    if w_temp % 2 != 0:
-
-        w = int(np.ceil(w_temp/2))
-        for i in range(w):
-            u[i] = np.mean(v[0:w+i])
-            u[n-i] = np.mean(v[n-(w-1)-i:])
-
-        n1 = 1 + w
-        n2 = n - w
-
-        for i in range(n1-1,n2+1):
-        
-            u[i] = np.mean(v[i - w + 1:i + w])
+    return sos, order
 
-    else:
+class StreamingFilter:
 
-        w = int(w_temp/2)
-        for i in range(w):
-            u[i] = np.mean(v[0:w+i])
-            u[n-i] = np.mean(v[n-(w-1)-(i+1):])
+    """ Causal band-pass filter (with optional notch filters) for block-wise online processing, e.g. of the packets that are passed to getspikesonline.
+    The filter state (the initial conditions of scipy.signal.sosfilt) is kept between the blocks, so every block is filtered in O(block) time 
+    without padding, and filtering a recording block by block gives the same result as filtering it at once.
 
-        n1 = 1 + w
-        n2 = n - w
+    Unlike bandpass_filter (filtfilt, zero-phase) the filter runs forward only, so it has the magnitude response of a single pass of the 
+    band-pass filter and introduces a phase delay. The offline notch_filter detects the line interference in the spectrum of the whole 
+    signal, which is not possible online, so the notch filters remove fixed frequencies (e.g. 50 Hz and its harmonics).
 
-        for i in range(n1-1,n2+1):
-            u[i] = np.mean(v[i - w:i + w ])
+    Args:
+        nchans (int): Number of channels (rows) of the blocks.
+        fsamp (int): Sample frequency in Hz.
+        emg_type (int, optional): Type of EMG as in bandpass_filter, 0 = surface and 1 = intramuscular.
+        notch_freqs (list, optional): Frequencies in Hz of the notch filters. Defaults to no notch filters.
+        notch_quality (float, optional): Quality factor of the notch filters (centre frequency / bandwidth).
+    """
 
-    return u
+    def __init__(self, nchans, fsamp, emg_type = 0, notch_freqs = None, notch_quality = 30):
+        self.nchans = nchans
+        self.fsamp = fsamp
+
+        # the notch filters are applied before the band-pass filter, all filters are cascaded as one set of second-order sections
+        sections = [scipy.signal.tf2sos(*scipy.signal.iirnotch(freq, notch_quality, fs = fsamp)) for freq in (notch_freqs or [])]
+        sections.append(bandpass_sos(fsamp, emg_type)[0])
+        self.sos = np.vstack(sections)
+        self.reset()
+
+    def reset(self):
+        """ Forget the filter state, the next block is filtered as the start of a new recording """
+        self.zi = None
+
+    def filter(self, block):
+        """ Filter the next (channels x samples) block, returns the filtered block as float64 """
+        block = np.asarray(block, dtype = np.float64)
+        if np.shape(block)[0] != self.nchans:
+            raise ValueError('Expected blocks with ' + str(self.nchans) + ' channels, got ' + str(np.shape(block)[0]) + '.')
+        if self.zi is None:
+            # start in the steady state of the first sample of every channel, to avoid the transient of a step at the first sample
+            self.zi = scipy.signal.sosfilt_zi(self.sos)[:, np.newaxis, :] * block[np.newaxis, :, 0, np.newaxis]
+        filtered_block, self.zi = scipy.signal.sosfilt(self.sos, block, axis = -1, zi = self.zi)
+        return filtered_block
+
+def moving_mean1d(v,w,axis = -1):
+    """ Moving average filter that replicates the method of movmean in MATLAB
+    v is the vector (or array, filtered along axis) to be filtered via a moving average
+    w is the window length of this filter 
+    As in MATLAB, the window of an odd length is centered on the current sample, the window of an even length 
+    is centered on the current and the previous sample, and the windows are shrunk at the edges. The means 
+    are computed from a cumulative sum, so the cost does not depend on the window length """
+
+    v = np.asarray(v)
+    v_last = np.moveaxis(v, axis, -1)
+    n = np.shape(v_last)[-1]
+    w = int(w)
+
+    # window of sample i: [i - before, i + after], clipped to the signal
+    before = w // 2
+    after = (w - 1) // 2
+    positions = np.arange(n)
+    lo = np.maximum(positions - before, 0)
+    hi = np.minimum(positions + after + 1, n)
+
+    # the mean of the signal is subtracted before summing, which keeps the cumulative sum (and its rounding errors) small
+    offset = np.mean(v_last, axis = -1, dtype = np.float64, keepdims = True) if n > 0 else 0
+    cumulative = np.zeros(np.shape(v_last)[:-1] + (n + 1,))
+    np.cumsum(v_last - offset, axis = -1, out = cumulative[..., 1:])
+    u = (cumulative[..., hi] - cumulative[..., lo]) / (hi - lo) + offset
+
+    # same data type as the input, as the original implementation that filled a copy of v
+    if np.issubdtype(v.dtype, np.floating):
+        u = u.astype(v.dtype, copy = False)
+    return np.moveaxis(u, -1, axis)
     
 
 ################################# CONVOLUTIVE SPHERING TOOLS ##########################################################
@@ -166,13 +211,152 @@ def extend_emg(extended_template, signal, ext_factor):
     return extended_template
 
 
-def whiten_emg(signal):
+class ExtendedEMG:
+
+    """ Implicit version of the extended observation matrix of extend_emg, computed from the (channels x observations) signal without storing 
+    the ext_factor shifted copies. Row i*nchans + c holds channel c delayed by i samples, there are nobvs + ext_factor - 1 columns and 
+    the samples outside the signal are zero, as in the matrix of extend_emg.
+
+    Products with the matrix are computed per time shift: W @ eSIG for a (k x rows) matrix or a vector, and eSIG @ V for a (columns x k) 
+    matrix or a vector. demean() gives the matrix with its row means removed (as scipy.signal.detrend with type 'constant'), eSIG[:, a:b] 
+    selects columns and toarray() materializes the matrix. """
+
+    __array_ufunc__ = None # numpy arrays defer W @ eSIG to __rmatmul__
+
+    def __init__(self, signal, ext_factor, row_means = None, columns = None):
+        self.signal = np.asarray(signal, dtype = np.float64)
+        self.ext_factor = int(ext_factor)
+        self.nchans, self.nobvs = np.shape(self.signal)
+        self.row_means = row_means # mean of every channel over all columns, subtracted from its rows (None = not demeaned)
+        self.columns = range(self.nobvs + self.ext_factor - 1) if columns is None else columns # selected columns of the full matrix
+        self.shape = (self.nchans*self.ext_factor, len(self.columns))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def demean(self):
+        """ Remove the mean of every row, over all columns of the full matrix """
+        row_means = np.sum(self.signal, axis = 1) / (self.nobvs + self.ext_factor - 1)
+        return ExtendedEMG(self.signal, self.ext_factor, row_means, self.columns)
+
+    def __getitem__(self, key):
+        rows, columns = key
+        if rows != slice(None) or not isinstance(columns, slice) or columns.step not in (None, 1):
+            raise IndexError('ExtendedEMG only supports selecting a range of columns, eSIG[:, a:b]')
+        return ExtendedEMG(self.signal, self.ext_factor, self.row_means, self.columns[columns])
+
+    def _shifts(self):
+        # per time shift i: the rows of the shift, and the columns (relative to the selection) and samples of the signal that overlap
+        start, stop = self.columns.start, self.columns.stop
+        for i in range(self.ext_factor):
+            first, last = max(start, i), min(stop, i + self.nobvs)
+            if first < last:
+                yield slice(self.nchans*i, self.nchans*(i+1)), slice(first - start, last - start), slice(first - i, last - i)
+
+    def __rmatmul__(self, W):
+        """ W @ eSIG """
+        W = np.asarray(W)
+        result = np.zeros(np.shape(W)[:-1] + (self.shape[1],), dtype = np.result_type(W, np.float64))
+        for rows, columns, samples in self._shifts():
+            result[..., columns] += W[..., rows] @ self.signal[:, samples]
+        if self.row_means is not None:
+            result -= (W @ np.tile(self.row_means, self.ext_factor))[..., np.newaxis]
+        return result
+
+    def __matmul__(self, V):
+        """ eSIG @ V """
+        V = np.asarray(V)
+        result = np.zeros((self.shape[0],) + np.shape(V)[1:], dtype = np.result_type(V, np.float64))
+        for rows, columns, samples in self._shifts():
+            result[rows] = self.signal[:, samples] @ V[columns]
+        if self.row_means is not None:
+            result -= np.multiply.outer(np.tile(self.row_means, self.ext_factor), np.sum(V, axis = 0))
+        return result
+
+    def toarray(self):
+        """ Materialize the (selected columns of the) extended observation matrix """
+        result = np.zeros(self.shape)
+        for rows, columns, samples in self._shifts():
+            result[rows, columns] = self.signal[:, samples]
+        if self.row_means is not None:
+            result -= np.tile(self.row_means, self.ext_factor)[:, np.newaxis]
+        return result
+
+    def gram(self, exact = True):
+        """ eSIG @ eSIG.T, assembled from the lagged cross-correlations of the channels (see extended_gram) """
+        result = extended_gram(self.signal, self.ext_factor, self.columns, exact = exact)
+        if self.row_means is not None:
+            # (X - m 1')(X - m 1')' = X X' - s m' - m s' + cols m m', with s the row sums of X
+            raw_sums = ExtendedEMG(self.signal, self.ext_factor, columns = self.columns) @ np.ones(self.shape[1])
+            means = np.tile(self.row_means, self.ext_factor)
+            result += - np.outer(raw_sums, means) - np.outer(means, raw_sums) + self.shape[1] * np.outer(means, means)
+        return result
+
+    def covariance(self, exact = True):
+        """ Covariance matrix of the rows, as np.cov(eSIG, bias = True) """
+        row_means = (self @ np.ones(self.shape[1])) / self.shape[1]
+        return self.gram(exact = exact) / self.shape[1] - np.outer(row_means, row_means)
+
+
+def lagged_xcorr(signal, max_lag, start = 0, stop = None):
+
+    """ Lagged cross-correlations of all channel pairs of a (channels x observations) signal, xcorr[lag][c,d] = sum_s signal[c,s]*signal[d,s+lag] 
+    for lag = 0 ... max_lag, summed over the observations s for which s and s+lag are both within start:stop. One matrix product per lag """
+
+    signal = np.asarray(signal, dtype = np.float64)[:, start:stop]
+    nchans, nobvs = np.shape(signal)
+    xcorr = np.zeros([max_lag + 1, nchans, nchans])
+    for lag in range(min(max_lag + 1, nobvs)):
+        xcorr[lag] = signal[:, :nobvs - lag] @ signal[:, lag:].T
+    return xcorr
+
+
+def extended_gram(signal, ext_factor, columns = None, exact = True):
+
+    """ Gram matrix eSIG @ eSIG.T of the extended observation matrix of extend_emg (or of its columns in the range columns), without extending the signal. 
+    Block (i,j) of the gram matrix is the cross-correlation of the channels at lag i-j, so the matrix is block-Toeplitz and follows from 
+    the ext_factor lagged cross-correlations (lagged_xcorr) instead of the product of the extended matrices, which is ext_factor times as expensive.
+
+    Over all nobvs + ext_factor - 1 columns the block-Toeplitz matrix is exact. For a range of columns (e.g. without the edges), every block 
+    misses or gains fewer than ext_factor products at both ends of the range. With exact these edge terms are corrected, 
+    otherwise every block of a lag gets the same cross-correlation (the stationary approximation) """
+
+    signal = np.asarray(signal, dtype = np.float64)
+    nchans, nobvs = np.shape(signal)
+    columns = range(nobvs + ext_factor - 1) if columns is None else columns
+    first, last = columns.start, max(columns.start, columns.stop)
+
+    # row i of a block row holds signal[:, first-i:last-i], the cross-correlations cover the observations of all block rows
+    start, stop = max(first - ext_factor + 1, 0), max(min(last, nobvs), 0)
+    xcorr = lagged_xcorr(signal, ext_factor - 1, start, stop)
+
+    gram = np.zeros([nchans*ext_factor, nchans*ext_factor])
+    for i in range(ext_factor):
+        for j in range(i + 1):
+            lag = i - j
+            block = xcorr[lag].copy()
+            if exact:
+                # remove the products of observations before first-i and from last-i on, which are not in the columns of block row i
+                for s0, s1 in [(start, max(start, min(first - i, stop - lag))), (max(last - i, start), stop - lag)]:
+                    if s0 < s1:
+                        block -= signal[:, s0:s1] @ signal[:, s0 + lag:s1 + lag].T
+            gram[nchans*i:nchans*(i+1), nchans*j:nchans*(j+1)] = block
+            gram[nchans*j:nchans*(j+1), nchans*i:nchans*(i+1)] = block.T
+    return gram
+
+
+def whiten_emg(signal, columns = slice(None)):
     
     """ Whitening the EMG signal imposes a signal covariance matrix equal to the identity matrix at time lag zero. Use to shrink large directions of variance
-    and expand small directions of variance in the dataset. With this, you decorrelate the data. """
+    and expand small directions of variance in the dataset. With this, you decorrelate the data. 
+    The signal can be an array or an ExtendedEMG. The covariance is computed over all columns, only the selected columns are whitened and returned """
 
     # get the covariance matrix of the extended EMG observations
-    cov_mat = np.cov(np.squeeze(signal),bias=True)
+    # np.cov always accumulates in float64, the eigendecomposition below needs this precision even if the raw samples are float32
+    if isinstance(signal, ExtendedEMG):
+        cov_mat = signal.covariance()
+    else:
+        cov_mat = np.cov(np.squeeze(signal),bias=True)
     
     # get the eigenvalues and eigenvectors of the covariance matrix
     evalues, evectors  = scipy.linalg.eigh(cov_mat) # changed scipy.lignals.eigh(cov_mat) eigh to eig 
@@ -191,11 +375,12 @@ def whiten_emg(signal):
     # use the rank limit to segment the eigenvalues and the eigenvectors
     evectors = evectors[:,evalues > hard_limit] #1 shorter 
     evalues = evalues[evalues>hard_limit]
-    diag_mat = np.diag(evalues)
     
-    whitening_mat = evectors @ np.linalg.inv(np.sqrt(diag_mat)) @ np.transpose(evectors)
-    dewhitening_mat = evectors @ np.sqrt(diag_mat) @ np.transpose(evectors)
-    whitened_emg =  np.matmul(whitening_mat, signal).real 
+    # scale the eigenvectors instead of multiplying with (the inverse of) the square root of the diagonal eigenvalue matrix
+    # whitening_mat @ whitening_mat is the regularised inverse of the covariance matrix, evectors @ diag(1/evalues) @ evectors'
+    whitening_mat = (evectors / np.sqrt(evalues)) @ np.transpose(evectors)
+    dewhitening_mat = (evectors * np.sqrt(evalues)) @ np.transpose(evectors)
+    whitened_emg =  (whitening_mat @ signal[:, columns]).real 
 
     return whitened_emg, whitening_mat, dewhitening_mat
 
@@ -312,7 +497,10 @@ def pcaesig(signal):
         D (numpy.ndarray): Diagonal matrix of eigenvalues.
     """
     # Calculate the covariance matrix of the transposed signal (time points x channels)
-    covariance_matrix = np.cov(signal, bias=True)
+    if isinstance(signal, ExtendedEMG):
+        covariance_matrix = signal.covariance()
+    else:
+        covariance_matrix = np.cov(signal, bias=True)
 
     # Perform eigenvalue decomposition
     eigenvalues, eigenvectors = np.linalg.eig(covariance_matrix)
@@ -373,8 +561,9 @@ def whiteesig(signal, E, D):
             The dewhitening matrix.
         """
         
-        whiteningMatrix = E @ np.linalg.inv(np.sqrt(D)) @ E.T
-        dewhiteningMatrix = E @ np.sqrt(D) @ E.T
+        sqrt_evalues = np.sqrt(np.diag(D))
+        whiteningMatrix = (E / sqrt_evalues) @ E.T
+        dewhiteningMatrix = (E * sqrt_evalues) @ E.T
         whitensignals = whiteningMatrix @ signal
         
         return whitensignals, whiteningMatrix, dewhiteningMatrix
@@ -0,0 +1,79 @@
+'''
+Chunked exports of recordings, shared by the readers.
+
+The samples are requested chunk by chunk through a get_chunk(start, stop) function that returns the
+(channels x samples) array of samples start to stop, so a recording never has to be converted as a whole.
+'''
+
+import os
+import re
+import json
+import locale
+import numpy as np
+import pandas as pd
+
+EXPORT_CHUNK_SIZE = 100000 # number of samples that are converted and written at once
+
+
+def write_csv(save_name, ch_names, get_chunk, num_samples, sample_rate, samples_per_chunk = None):
+    """ Write the samples to a UTF-16 .csv file, with the sample rate as the last column.
+
+    The file is written in chunks of samples_per_chunk samples (default EXPORT_CHUNK_SIZE), with the same
+    layout as writing the whole recording at once: separator ';', the decimal point of the local language
+    settings and a header with the column names.
+    """
+    samples_per_chunk = EXPORT_CHUNK_SIZE if samples_per_chunk is None else samples_per_chunk
+    if samples_per_chunk < 1:
+        raise ValueError('samples_per_chunk should be a positive number of samples')
+
+    # Get decimal point representation (in local language settings)
+    langlocale = locale.getdefaultlocale()[0]
+    locale.setlocale(locale.LC_ALL, langlocale)
+    dp = locale.localeconv()['decimal_point']
+
+    columns = list(ch_names) + ['Fs (Hz)']
+    with open(save_name, 'w', encoding = 'utf-16', newline = '') as f:
+        if num_samples == 0:
+            pd.DataFrame(columns = columns).to_csv(f, sep = ';', decimal = dp, index = False)
+        for start in range(0, num_samples, samples_per_chunk):
+            stop = min(start + samples_per_chunk, num_samples)
+
+            # Add Sample rate as a separate column to the samples
+            samples = np.empty((len(columns), stop - start))
+            samples[:-1] = get_chunk(start, stop)
+            samples[-1] = sample_rate
+
+            df = pd.DataFrame(data = samples.T, columns = columns)
+            df.to_csv(f, sep = ';', decimal = dp, index = False, header = start == 0)
+
+
+def write_columns(folder, ch_names, units, get_chunk, num_samples, sample_rate, source = None, samples_per_chunk = None):
+    """ Write every channel to its own float32 .npy file, with a manifest.json that describes them.
+
+    The .npy files can be memory-mapped, e.g. np.load(file, mmap_mode = 'r'). The manifest holds the sample
+    rate, the number of samples and per channel its name, unit and file name (relative to the folder).
+    """
+    samples_per_chunk = EXPORT_CHUNK_SIZE if samples_per_chunk is None else samples_per_chunk
+    if samples_per_chunk < 1:
+        raise ValueError('samples_per_chunk should be a positive number of samples')
+    num_samples = int(num_samples)
+    os.makedirs(folder, exist_ok = True)
+
+    # File names start with the channel index, so that channels with the same name do not overwrite each other
+    files = ['%03d_%s.npy' % (i, re.sub(r'[^\w\-]', '_', name)) for i, name in enumerate(ch_names)]
+    columns = [np.lib.format.open_memmap(os.path.join(folder, file), mode = 'w+', dtype = np.float32, shape = (num_samples,))
+               for file in files]
+
+    for start in range(0, num_samples, samples_per_chunk):
+        stop = min(start + samples_per_chunk, num_samples)
+        chunk = get_chunk(start, stop)
+        for i, column in enumerate(columns):
+            column[start:stop] = chunk[i]
+    for column in columns:
+        column.flush()
+    del columns
+
+    manifest = dict(source = source, sample_rate = float(sample_rate), num_samples = int(num_samples), dtype = 'float32',
+                    channels = [dict(name = name, unit = unit, file = file) for name, unit, file in zip(ch_names, units, files)])
+    with open(os.path.join(folder, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 4)
@@ -0,0 +1,80 @@
+'''
+Conversion of the live impedance channels (CYCL_IDX, CYCL_ST1 and CYCL_ST2) to impedances per channel.
+
+Every sample of the CYCL channels holds the impedance of one channel, the channel index is stored in CYCL_IDX.
+The impedance of a channel is valid from the sample where it is measured until it is measured again, or until
+length_stored_idx samples have passed. Outside these intervals the impedance is set to the default value of 1000.
+'''
+
+import numpy as np
+
+DEFAULT_IMPEDANCE = 1000
+
+
+def expand_live_impedance(cycl_idx, cycl_imp, cycl_cap, num_channels, compact = False):
+    """ Convert the live impedance channels to the impedance of every channel.
+
+    Args:
+        cycl_idx (array): CYCL_IDX channel, index of the channel that is measured at every sample.
+        cycl_imp (array): CYCL_ST1 channel, real part of the impedance (resistance).
+        cycl_cap (array): CYCL_ST2 channel, imaginary part of the impedance (capacity).
+        num_channels (int): Number of channels in the data.
+        compact (bool, optional): Return the change-points per channel instead of the (channels x samples) arrays.
+
+    Returns:
+        tuple: (live_imp, live_cap). By default two (channels x samples) arrays. With compact = True, two lists with
+        per channel a tuple (indices, values): the value of the channel changes to values[k] at sample indices[k]
+        and holds until indices[k+1].
+    """
+    cycl_idx = np.asarray(cycl_idx).astype(int)
+    cycl_imp = np.asarray(cycl_imp, dtype = np.float64)
+    cycl_cap = np.asarray(cycl_cap, dtype = np.float64)
+    num_samples = len(cycl_idx)
+    positions = np.arange(num_samples)
+
+    # Last index of the channel information is the maximum of cycl_idx. So, channel indices range from 0 to this number.
+    # Therefore, length of stored info is one more (0 should be included)
+    length_stored_idx = int(np.max(cycl_idx) + 1)
+
+    # Change-points of the channels that are never measured only hold the default value
+    default = (np.zeros(1, dtype = int), np.full(1, DEFAULT_IMPEDANCE, dtype = np.float64))
+    live_imp = [default] * num_channels
+    live_cap = [default] * num_channels
+    for ch in np.unique(cycl_idx):
+        measured = positions[cycl_idx == ch]
+        live_imp[ch] = _change_points(measured, cycl_imp[measured], length_stored_idx, num_samples)
+        live_cap[ch] = _change_points(measured, cycl_cap[measured], length_stored_idx, num_samples)
+
+    if not compact:
+        live_imp = _expand(live_imp, num_samples)
+        live_cap = _expand(live_cap, num_samples)
+
+    return live_imp, live_cap
+
+
+def _change_points(measured, values, length_stored_idx, num_samples):
+    # A value starts at its measurement and falls back to the default after length_stored_idx samples,
+    # unless the channel is measured again before that
+    expired = measured[np.append(np.diff(measured) > length_stored_idx, True)] + length_stored_idx
+    expired = expired[expired < num_samples]
+
+    indices = np.concatenate(([0], measured, expired))
+    all_values = np.concatenate(([DEFAULT_IMPEDANCE], values, np.full(len(expired), DEFAULT_IMPEDANCE)))
+
+    # Sort on the sample index, a measurement at sample 0 replaces the default value
+    order = np.lexsort((np.arange(len(indices)), indices))
+    indices, all_values = indices[order], all_values[order]
+    keep = np.append(indices[1:] != indices[:-1], True)
+    indices, all_values = indices[keep], all_values[keep]
+
+    # Only keep the samples where the value changes
+    keep = np.append(True, all_values[1:] != all_values[:-1])
+    return indices[keep], all_values[keep]
+
+
+def _expand(change_points, num_samples):
+    # Every value holds until the next change-point
+    expanded = np.empty((len(change_points), num_samples), dtype = np.float64)
+    for ch, (indices, values) in enumerate(change_points):
+        expanded[ch] = np.repeat(values, np.diff(indices, append = num_samples))
+    return expanded
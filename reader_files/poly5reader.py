@@ -37,14 +37,29 @@ import mne
 import tkinter as tk
 from tkinter import filedialog
 import pandas as pd
-import locale
+from glob import glob
 
-from os.path import join, dirname, realpath
+from os.path import join, dirname, realpath, getsize, splitext
+from reader_files.recording_cache import load_cache, save_cache
+from reader_files.export import write_csv, write_columns
+from reader_files.live_impedance import expand_live_impedance
 Reader_dir = dirname(realpath(__file__)) # directory of this file
 modules_dir = join(Reader_dir, '../') # directory with all modules
 
 class Poly5Reader: 
-    def __init__(self, filename=None, readAll = True):
+    def __init__(self, filename=None, readAll = True, mode = 'read', channels = None, start = 0, stop = None, reorder_grid = True, 
+                 cache = False, cache_dir = None, dtype = np.float32):
+        # mode 'read' decodes all samples into memory, mode 'mmap' memory-maps the file and
+        # exposes the samples as a lazily decoded (channels x samples) view
+        # channels (names or indices in the order of ch_names) and start/stop (in samples) restrict 
+        # the data that is decoded, other channels and samples are skipped
+        # reorder_grid sorts the textile grid channels on row and column, otherwise the file order is kept
+        # cache keeps the decoded samples in a sidecar cache (see recording_cache) in cache_dir, so that
+        # reading the same file again only memory-maps them, this applies to mode 'read'
+        # dtype is the dtype of the decoded samples in mode 'read', the file stores float32 so the default
+        # float32 is lossless, consumers that need float64 (MNE, the covariance in whiten_emg) promote a copy
+        if mode not in ('read', 'mmap'):
+            raise ValueError("Invalid mode. Choose 'read' or 'mmap'.")
         if filename==None:
             root = tk.Tk()
 
@@ -53,6 +68,14 @@ class Poly5Reader:
             
         self.filename = filename
         self.readAll = readAll
+        self.mode = mode
+        self.selected_channels = channels
+        self.start = start
+        self.stop = stop
+        self.reorder_grid = reorder_grid
+        self.cache = cache
+        self.cache_dir = cache_dir
+        self.dtype = np.dtype(dtype)
         print('Reading file ', filename)
         self._readFile(filename)
         
@@ -105,32 +128,39 @@ class Poly5Reader:
         # convert from microvolts to volts if necessary
         scale = np.array([1e-6 if (u == "µVolt" or u == "uVolt" or u == '\u03BCVolt') else 1 for u in units])
 
-        raw = mne.io.RawArray(self.samples * np.expand_dims(scale, axis=1), info)
+        # MNE stores the data as float64, so the samples are promoted once and the scale is applied in place
+        samples = np.array(self.samples, dtype=np.float64)
+        samples *= np.expand_dims(scale, axis=1)
+        raw = mne.io.RawArray(samples, info)
         return raw
 
-    def export_to_csv(self):
+    def export_to_csv(self, samples_per_chunk = None):
+        "Export the samples to a .csv file next to the .poly5 file, converting and writing samples_per_chunk samples at a time"
         
         # Add unit names to the column header
-        ch_names = [self.ch_names[i] + ' (' + self.ch_unit_names[i] + ')' for i in range(len(self.ch_names))]
-        ch_names += ['Fs (Hz)']
+        ch_names = [self.ch_names[i] + ' (' + self.ch_units[i] + ')' for i in range(len(self.ch_names))]
         
-        # Add Sample rate as a separate column to the samples vector
-        samples = np.vstack((self.samples, np.zeros((1,np.shape(self.samples)[1]))))
-        samples[-1,:] = self.sample_rate
-        
-        # Get decimal point representation (in local language settings)
-        langlocale = locale.getdefaultlocale()[0]
-        locale.setlocale(locale.LC_ALL, langlocale)
-        dp = locale.localeconv()['decimal_point']
-        
-        # Write to dataframe
-        df = pd.DataFrame(data = samples.T, columns = ch_names)
-        # Export dataframe to .csv
+        # Export the samples, with the sample rate as a separate column, to .csv
         if self.filename.lower().endswith('.poly5'):
             save_name = self.filename.lower().replace('.poly5', '.csv')
-            df.to_csv(path_or_buf = save_name, sep = ';', decimal = dp, index = False, encoding = 'utf-16')
+            write_csv(save_name, ch_names, lambda start, stop: self.samples[:, start:stop], np.shape(self.samples)[1], 
+                      self.sample_rate, samples_per_chunk)
             print('Exported to .csv successfully')
         return
+    
+    def export_to_npy(self, folder = None, samples_per_chunk = None):
+        """Export every channel to a float32 .npy file with a manifest.json, that can be memory-mapped by other tools.
+        
+        Args:
+            folder (str, optional): Output folder. Defaults to the file name of the recording with '_channels'.
+            samples_per_chunk (int, optional): Number of samples that are written at once.
+        """
+        if folder is None:
+            folder = splitext(self.filename)[0] + '_channels'
+        write_columns(folder, self.ch_names, self.ch_units, lambda start, stop: self.samples[:, start:stop], 
+                      np.shape(self.samples)[1], self.sample_rate, source = self.filename, samples_per_chunk = samples_per_chunk)
+        print('Exported to ' + folder + ' successfully')
+        return
 
     def _readFile(self, filename):
         try:
@@ -139,44 +169,43 @@ class Poly5Reader:
             try:    
                 self._readHeader(file_obj)
                 self.channels = self._readSignalDescription(file_obj)
-                self._myfmt = 'f' * self.num_channels*self.num_samples_per_block
+                self._data_offset = file_obj.tell()
                 self._buffer_size = self.num_channels*self.num_samples_per_block
+                # Every data block is an 86 byte block header followed by the float32 samples (samples x channels)
+                self._block_dtype = np.dtype([('header', 'V86'), 
+                                              ('samples', '<f4', (self.num_samples_per_block, self.num_channels))])
+                file_channels, self.ch_names, self.ch_unit_names = self._selectChannels()
+                self._file_channels = file_channels
                 
-                if self.readAll:
-                    sample_buffer = np.zeros(self.num_channels * self.num_samples)
-     
-                    for i in range(self.num_data_blocks):
-                        print('\rProgress: % 0.1f %%' %(100*i/self.num_data_blocks), end="\r")
-                         
-                        # Check whether final data block is filled completely or not
-                        if i == self.num_data_blocks-1:
-                            _final_block_size = self.num_samples / self.num_data_blocks
-                            if _final_block_size % self.num_samples_per_block != 0:
-                                data_block = self._readSignalBlock(file_obj, 
-                                                                   buffer_size = (self.num_samples%self.num_samples_per_block) * self.num_channels, 
-                                                                   myfmt = 'f' * (self.num_samples%self.num_samples_per_block) * self.num_channels)
-                            else:
-                                data_block = self._readSignalBlock(file_obj, self._buffer_size, self._myfmt)
-                        else:
-                            data_block = self._readSignalBlock(file_obj, self._buffer_size, self._myfmt)
-                        
-                        # Get indices that need to be filled in the samples array
-                        i1 = i * self.num_samples_per_block * self.num_channels
-                        i2 = (i+1) * self.num_samples_per_block * self.num_channels
-                        
-                        # Correct for final data block if this is not fully filled
-                        if i2 >= self.num_samples * self.num_channels:
-                            i2 = self.num_samples * self.num_channels
-                        
-                        # Insert the read data_block into the sample_buffer array
-                        sample_buffer[i1:i2] = data_block
-                       
-                    samples=np.transpose(np.reshape(sample_buffer, [self.num_samples, self.num_channels]))
+                if self.mode == 'mmap':
+                    self.samples, _ = self._mapSignalBlocks(file_channels, self.start, self.stop)
+                    print('Done mapping data.')
+                    self.file_obj.close()
+                    
+                elif self.readAll and self.cache:
+                    # Select the samples from the cached (channels x samples) array of the whole file, in file order
+                    file_samples = self._readCachedSamples(file_obj)
+                    start, stop = self._checkSampleRange(self.start, self.stop)
+                    self.samples = file_samples[file_channels, start:stop].astype(self.dtype)
                     
-                    ch_names = [s._Channel__name for s in self.channels]
-                    self.ch_unit_names = [s._Channel__unit_name for s in self.channels]
+                    print('Done reading data.')
+                    self.file_obj.close()
+                    
+                elif self.readAll and (self.selected_channels is not None or self.start != 0 or self.stop is not None):
+                    # Decode only the blocks that hold samples start to stop, and only the selected channels
+                    sample_buffer = self._readSampleRange(file_obj, file_channels, self.start, self.stop)
+                    self.samples = np.transpose(sample_buffer).astype(self.dtype)
                     
-                    self.samples, self.ch_names = self._reorder_grid(samples, ch_names)
+                    print('Done reading data.')
+                    self.file_obj.close()
+                    
+                elif self.readAll:
+                    # Decode the whole data section at once, the final block may be only partially filled
+                    sample_buffer = self._readSignalBlocks(file_obj, self.num_data_blocks)[:self.num_samples]
+                    self.samples = np.transpose(sample_buffer).astype(self.dtype)
+                    
+                    if self.reorder_grid:
+                        self.samples, _ = self._reorder_grid(self.samples, [s._Channel__name for s in self.channels])
 
                     print('Done reading data.')
                     self.file_obj.close()
@@ -188,22 +217,107 @@ class Poly5Reader:
             print('Could not open file. ')
         
         
+    @classmethod
+    def scan(cls, filename):
+        """Read only the header and the channel descriptions of a Poly5 file, without touching the sample data.
+        
+        Args:
+            filename (str): Path of the Poly5 file.
+        
+        Returns:
+            dict: filename, ch_names and ch_unit_names (in file order), sample_rate, num_channels, num_samples, 
+            duration (s), start_time and data_size (bytes of the float32 samples).
+        """
+        reader = cls.__new__(cls)
+        reader.filename = filename
+        with open(filename, "rb") as f:
+            reader._readHeader(f)
+            channels = reader._readSignalDescription(f)
+        
+        return dict(filename = filename, 
+                    ch_names = [s._Channel__name for s in channels], 
+                    ch_unit_names = [s._Channel__unit_name for s in channels], 
+                    sample_rate = reader.sample_rate, 
+                    num_channels = reader.num_channels, 
+                    num_samples = reader.num_samples, 
+                    duration = reader.num_samples / reader.sample_rate if reader.sample_rate else 0, 
+                    start_time = reader.start_time, 
+                    data_size = reader.num_samples * reader.num_channels * 4)
+    
+    @classmethod
+    def scan_directory(cls, directory, recursive = False):
+        """Scan the headers of all Poly5 files in a directory, see scan.
+        
+        Args:
+            directory (str): Directory with Poly5 files.
+            recursive (bool, optional): Also scan the subdirectories. Defaults to False.
+        
+        Returns:
+            list: The scan result of every Poly5 file, sorted on file name. Files that can not be read are skipped.
+        """
+        pattern = join('**', '*') if recursive else '*'
+        filenames = sorted(f for f in glob(join(directory, pattern), recursive = recursive) if f.lower().endswith('.poly5'))
+        
+        scans = []
+        for filename in filenames:
+            try:
+                scans.append(cls.scan(filename))
+            except (OSError, struct.error, ValueError) as e:
+                print('Could not scan ' + filename + ': ' + str(e))
+        return scans
+        
     def readSamples(self, n_blocks = None):
         "Function to read a subset of sample blocks from a file"
         if n_blocks==None:
             n_blocks = self.num_data_blocks
             
-        sample_buffer = np.zeros(self.num_channels*n_blocks*self.num_samples_per_block)
-     
-        for i in range(n_blocks):
-            data_block = self._readSignalBlock(self.file_obj, self._buffer_size, self._myfmt)
-            i1 = i * self.num_samples_per_block * self.num_channels
-            i2 = (i+1) * self.num_samples_per_block * self.num_channels
-            sample_buffer[i1:i2] = data_block
-        
-        samples = np.transpose(np.reshape(sample_buffer, [self.num_samples_per_block*(i+1), self.num_channels]))
+        sample_buffer = self._readSignalBlocks(self.file_obj, n_blocks)
+        samples = np.transpose(sample_buffer).astype(self.dtype)
         return samples
     
+    def iter_chunks(self, samples_per_chunk, channels = None, start = 0, stop = None):
+        """Generator that streams the file chunk by chunk, without loading it.
+        
+        Chunks are read from the memory-mapped file, independent of the current file position, so 
+        several iterators can run side by side. Chunk boundaries that are a multiple of 
+        num_samples_per_block avoid decoding a data block twice.
+        
+        Args:
+            samples_per_chunk (int): Number of samples per chunk, the final chunk may be shorter.
+            channels (list, optional): Channel names or indices (in the order of ch_names) to read. Defaults to all channels.
+            start (int, optional): First sample to read. Defaults to 0.
+            stop (int, optional): Sample to stop reading at (exclusive). Defaults to the end of the file.
+            In mode='mmap', start and stop count from the start sample of the reader, as in self.samples.
+        
+        Yields:
+            tuple: (chunk, offset), with chunk a float32 (channels x samples) array and offset the index 
+            of its first sample in the recording (so including the start sample of the reader in mode='mmap').
+        
+        Example, replaying a recording through the online decomposition:
+            stream_filter = StreamingFilter(len(emg_channels), fsamp, notch_freqs = [50, 100, 150])
+            for EMGtmp, offset in data.iter_chunks(fsamp // 10, channels = emg_channels):
+                EMGtmp = stream_filter.filter(EMGtmp)
+                pulse_trains, distimes_binary, distimes, extend2 = getspikesonline(EMGtmp, extensionfactor, extend2, ...)
+        """
+        if samples_per_chunk < 1:
+            raise ValueError('samples_per_chunk should be a positive number of samples')
+        
+        if isinstance(getattr(self, 'samples', None), Poly5Samples):
+            samples, ch_names = self.samples, self.ch_names
+            first_sample = self.start
+        else:
+            samples, ch_names = self._mapSignalBlocks()
+            first_sample = 0
+        
+        if channels is None:
+            channels = slice(None)
+        else:
+            channels = [ch_names.index(ch) if isinstance(ch, str) else int(ch) for ch in channels]
+        
+        stop = samples.shape[1] if stop is None else min(stop, samples.shape[1])
+        for offset in range(start, stop, samples_per_chunk):
+            yield samples[channels, offset:min(offset + samples_per_chunk, stop)], first_sample + offset
+    
             
     def _readHeader(self, f):
         header_data = struct.unpack("=31sH81phhBHi4xHHHHHHHiHHH64x", f.read(217))
@@ -241,14 +355,109 @@ class Poly5Reader:
         
             
     
-    def _readSignalBlock(self, f, buffer_size, myfmt):
-        f.read(86)
-        sampleData = f.read(buffer_size*4)
-        DataBlock = struct.unpack(myfmt, sampleData)
-        SignalBlock = np.asarray(DataBlock)
-        return SignalBlock
+    def _readSignalBlocks(self, f, n_blocks, file_channels = None):
+        "Decode n_blocks data blocks from the current file position into a (samples x channels) float32 array"
+        raw = f.read(n_blocks * self._block_dtype.itemsize)
+        n_full = len(raw) // self._block_dtype.itemsize
+        blocks = np.frombuffer(raw, dtype=self._block_dtype, count=n_full)
+        samples = blocks['samples'] if file_channels is None else blocks['samples'][:, :, file_channels]
+        samples = samples.reshape(-1, samples.shape[-1])
+        
+        # A final block that is not completely filled is stored without its empty part
+        remainder = raw[n_full * self._block_dtype.itemsize + 86:]
+        n_remaining = len(remainder) // (4 * self.num_channels)
+        if n_remaining > 0:
+            partial_block = np.frombuffer(remainder, dtype='<f4', count=n_remaining * self.num_channels)
+            partial_block = partial_block.reshape(n_remaining, self.num_channels)
+            if file_channels is not None:
+                partial_block = partial_block[:, file_channels]
+            samples = np.concatenate((samples, partial_block))
+        return samples
     
-    def _reorder_grid(self, samples, ch_names):
+    def _readCachedSamples(self, f):
+        "Load the samples of the whole file from the cache, decoding and caching them when there is no valid entry"
+        cached = load_cache(self.filename, self.cache_dir)
+        if cached is not None and cached[0]['samples'].shape == (self.num_channels, self.num_samples):
+            return cached[0]['samples']
+        
+        file_samples = np.transpose(self._readSignalBlocks(f, self.num_data_blocks)[:self.num_samples])
+        save_cache(self.filename, dict(samples = file_samples), cache_dir = self.cache_dir)
+        return file_samples
+    
+    def _readSampleRange(self, f, file_channels, start, stop):
+        "Decode samples [start, stop) of the given file channels, reading only the blocks that hold them"
+        start, stop = self._checkSampleRange(start, stop)
+        first_block = start // self.num_samples_per_block
+        last_block = -(-stop // self.num_samples_per_block)
+        
+        f.seek(self._data_offset + first_block * self._block_dtype.itemsize)
+        sample_buffer = self._readSignalBlocks(f, last_block - first_block, file_channels)
+        offset = first_block * self.num_samples_per_block
+        return sample_buffer[start - offset:stop - offset]
+    
+    def _checkSampleRange(self, start, stop):
+        stop = self.num_samples if stop is None else min(stop, self.num_samples)
+        if start < 0 or start > stop:
+            raise ValueError('Invalid sample range: start should be between 0 and stop.')
+        return start, stop
+    
+    @property
+    def ch_units(self):
+        "Unit names in the order of ch_names and the rows of samples (ch_unit_names stays in file order when all channels are read)"
+        file_units = [s._Channel__unit_name for s in self.channels]
+        return [file_units[i] for i in self._file_channels]
+    
+    def _selectChannels(self):
+        "Convert the selected channel names or indices (in the order of ch_names) to channel indices in the file"
+        file_names = [s._Channel__name for s in self.channels]
+        file_units = [s._Channel__unit_name for s in self.channels]
+        channel_order = self._channelOrder(file_names)
+        
+        if self.selected_channels is None:
+            # Keep the unit names in file order, as when reading the full file
+            return channel_order, [file_names[i] for i in channel_order], file_units
+        
+        file_channels = []
+        for ch in self.selected_channels:
+            if isinstance(ch, str):
+                if ch not in file_names:
+                    raise ValueError('Channel ' + ch + ' is not present in the file.')
+                file_channels.append(file_names.index(ch))
+            else:
+                file_channels.append(channel_order[ch])
+        file_channels = np.asarray(file_channels, dtype=int)
+        return file_channels, [file_names[i] for i in file_channels], [file_units[i] for i in file_channels]
+    
+    def _mapSignalBlocks(self, file_channels = None, start = 0, stop = None):
+        "Memory-map the data section as a lazily sliced (channels x samples) view, in the order of ch_names"
+        block_size = self._block_dtype.itemsize
+        file_size = getsize(self.filename)
+        n_full = min(self.num_data_blocks, (file_size - self._data_offset) // block_size)
+        blocks = np.memmap(self.filename, dtype=self._block_dtype, mode='r', offset=self._data_offset, shape=(n_full,))
+        
+        # A final block that is not completely filled is mapped separately
+        remainder_offset = self._data_offset + n_full * block_size + 86
+        n_remaining = max(0, (file_size - remainder_offset) // (4 * self.num_channels))
+        n_remaining = min(n_remaining, self.num_samples - n_full * self.num_samples_per_block)
+        partial_block = None
+        if n_remaining > 0:
+            partial_block = np.memmap(self.filename, dtype='<f4', mode='r', offset=remainder_offset, 
+                                      shape=(n_remaining, self.num_channels))
+        
+        ch_names = [s._Channel__name for s in self.channels]
+        if file_channels is None:
+            file_channels = self._channelOrder(ch_names)
+        start, stop = self._checkSampleRange(start, stop)
+        samples = Poly5Samples(blocks, partial_block, file_channels, start, stop)
+        return samples, [ch_names[i] for i in file_channels]
+    
+    def _channelOrder(self, ch_names):
+        "Order of the file channels in ch_names, with or without reordering the textile grid"
+        if self.reorder_grid:
+            return self._grid_order(ch_names)
+        return np.arange(len(ch_names))
+    
+    def _grid_order(self, ch_names):
         # Reordering textile grid channels
         channel_conversion_list = np.arange(0,len(ch_names), dtype = int)
         
@@ -265,6 +474,11 @@ class Poly5Reader:
         RCch.sort()
         for ch in range(len(RCch)):
             channel_conversion_list[ch] = RCch[ch][2]
+        
+        return channel_conversion_list
+    
+    def _reorder_grid(self, samples, ch_names):
+        channel_conversion_list = self._grid_order(ch_names)
             
         # Change the ordering of channels on the textile grid
         samples = samples[channel_conversion_list,:]
@@ -291,11 +505,13 @@ class Poly5Reader:
     def close(self):
         self.file_obj.close()
 
-    def read_live_impedance(self):
+    def read_live_impedance(self, compact = False):
         """
         This function reads the live measured impedances that are stored in the 
         datafile. If no live impedances are stored in the file, the function will return before proceeding
         
+        :param compact: return the change-points per channel instead of (channels x samples) arrays, see live_impedance.expand_live_impedance
+        :type compact: bool
         :return live_imp: real part of the impedances for all channels
         :rtype: array
         :return live_cap: imaginary part of the impedances for all channels
@@ -332,32 +548,83 @@ class Poly5Reader:
             live_cap = []
             return live_imp, live_cap
                 
-        # Cycle_idx channel defines the channel index of which the impedance information is stored in channels CYCL_ST1 and CYCL_ST2
-        # To find the amount of channels stored in the data, find the maximum value of the cycl_idx channel
-        maximum_cycl_idx = np.max(samples[cycl_idx_num,:])
+        # Cycle_idx channel defines the channel index of which the impedance information is stored in channels CYCL_ST1 and CYCL_ST2,
+        # cycl_imp stores the real part of the impedance value (resistance) and cycl_cap the imaginary part (capacity)
+        return expand_live_impedance(samples[cycl_idx_num,:], samples[cycl_imp_num,:], samples[cycl_cap_num,:], num_channels, compact)
+
+
+class Poly5Samples:
+    """ 'Poly5Samples' is a read-only (channels x samples) view on a memory-mapped Poly5 file.
+    
+        Slicing the view, e.g. samples[k, a:b], only decodes the data blocks that hold samples a to b. 
+        Slices are returned as float32 arrays, as stored in the file. np.asarray(samples) reads all samples.
+    """
+
+    def __init__(self, blocks, partial_block, channel_order, start, stop):
+        self._blocks = blocks
+        self._partial_block = partial_block
+        self._channel_order = np.asarray(channel_order, dtype=int)
+        self._samples_per_block = blocks.dtype['samples'].shape[0]
+        self._first_sample = start
+        self.shape = (len(self._channel_order), stop - start)
+        self.ndim = 2
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        samples = self[:, :]
+        return samples if dtype is None else samples.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        if len(key) != 2:
+            raise IndexError('Poly5Samples is indexed as [channels, samples]')
+        ch_key, sample_key = key
         
-        # Last index of the channel information is maximum_cylc_idx. So, channel indices range from 0 to this number. Therefore, length of stored info is one more (0 should be included)
-        length_stored_idx = int(maximum_cycl_idx+1)
+        # Channels are indexed in the order of ch_names, convert to the order in the file
+        file_channels = self._channel_order[ch_key]
         
-        # cycl_idx channel stores the id of the channel of which the impedance is measured at that index
-        cycl_idx = samples[cycl_idx_num,:]
-        # cycl_imp stores the real part of the impedance value (resistance)
-        cycl_imp = samples[cycl_imp_num,:]
-        # cycl_cap stores the imaginary part of the impedance value (capacity)
-        cycl_cap = samples[cycl_cap_num,:]
+        if isinstance(sample_key, slice):
+            start, stop, step = sample_key.indices(self.shape[1])
+            if step < 0:
+                return self[ch_key, :][..., sample_key]
+            stop = max(start, stop)
+        else:
+            start = int(sample_key) + self.shape[1] if sample_key < 0 else int(sample_key)
+            if not 0 <= start < self.shape[1]:
+                raise IndexError('Sample index out of range')
+            stop, step = start + 1, 1
         
-        # Define the variables that store the live impedance and live cap per channel. By default, set the values to 1000
-        live_imp = np.ones((num_channels, len(samples[cycl_imp_num,:]))) * 1000
-        live_cap = np.ones((num_channels, len(samples[cycl_cap_num,:]))) * 1000
+        samples = self._readRange(start + self._first_sample, stop + self._first_sample, 
+                                  np.atleast_1d(file_channels))[:, ::step]
+        if np.ndim(file_channels) == 0:
+            samples = samples[0]
+        if not isinstance(sample_key, slice):
+            samples = samples[..., 0]
+        return samples
+
+    def _readRange(self, start, stop, file_channels):
+        "Decode samples [start, stop) of the given file channels, touching only the blocks that hold them"
+        spb = self._samples_per_block
+        n_full = len(self._blocks)
+        first_block = start // spb
+        last_block = -(-stop // spb)
         
+        segments = []
+        if first_block < n_full:
+            blocks = self._blocks['samples'][first_block:min(last_block, n_full)]
+            segments.append(blocks[:, :, file_channels].reshape(-1, len(file_channels)))
+        if last_block > n_full and self._partial_block is not None:
+            segments.append(self._partial_block[:, file_channels])
+        if not segments:
+            return np.zeros((len(file_channels), 0), dtype=np.float32)
         
-        # Loop through the channels and store the values
-        for i in range(len(cycl_idx)):
-            # Values are measured once in every length_stored_idx channels, they are not updated for every sample
-            live_imp[int(cycl_idx[i]),i:i+length_stored_idx] = cycl_imp[i]
-            live_cap[int(cycl_idx[i]),i:i+length_stored_idx] = cycl_cap[i]
-
-        return live_imp[:,:], live_cap[:,:]
+        samples = np.concatenate(segments) if len(segments) > 1 else segments[0]
+        offset = first_block * spb
+        return np.ascontiguousarray(samples[start - offset:stop - offset].T)
 
 
 class Channel:
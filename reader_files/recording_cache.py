@@ -0,0 +1,184 @@
+'''
+Sidecar cache for parsed recordings.
+
+A cache entry holds the decoded arrays of one recording as .npy files, next to a .json header with the
+path, size, modification time and content hash of the source file. An entry is only used while the
+source file is unchanged, the arrays are then loaded as read-only memory-maps. When the total size of
+the cache directory exceeds the maximum size, the least recently used entries are removed.
+'''
+
+import os
+import re
+import json
+import hashlib
+import numpy as np
+
+from os.path import join, dirname, realpath, abspath, getsize, exists
+Reader_dir = dirname(realpath(__file__)) # directory of this file
+modules_dir = join(Reader_dir, '../') # directory with all modules
+
+CACHE_DIR = join(modules_dir, 'cache') # default directory of the cache entries
+CACHE_MAX_SIZE = 4 * 1024**3 # maximum total size of the cache directory in bytes
+HASH_BLOCK_SIZE = 1024**2 # number of bytes at the start and at the end of the file that are hashed
+ENTRY_FILE = re.compile(r'^([0-9a-f]{16})\.(.+\.)?(json|npy)$') # files of a cache entry (see entry_name) and their temporary files, other files in the directory are left alone
+
+
+def file_key(filename):
+    """ Identify the current content of a file by its path, size, modification time and content hash.
+
+    The hash covers the first and last HASH_BLOCK_SIZE bytes of the file, so that it stays cheap
+    compared to parsing the recording.
+    """
+    stat = os.stat(filename)
+    content_hash = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        content_hash.update(f.read(HASH_BLOCK_SIZE))
+        if stat.st_size > HASH_BLOCK_SIZE:
+            f.seek(max(HASH_BLOCK_SIZE, stat.st_size - HASH_BLOCK_SIZE))
+            content_hash.update(f.read(HASH_BLOCK_SIZE))
+    return dict(path = abspath(filename), size = stat.st_size, mtime = stat.st_mtime, hash = content_hash.hexdigest())
+
+
+def entry_name(filename, cache_dir = None, tag = None):
+    """ Path (without extension) of the cache entry of a source file, named after a hash of its absolute path and the tag. """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    key = abspath(filename) if tag is None else abspath(filename) + '|' + tag
+    return join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+
+def load_cache(filename, cache_dir = None, tag = None):
+    """ Load the cached arrays of a recording.
+
+    Args:
+        filename (str): Path of the source recording.
+        cache_dir (str, optional): Cache directory. Defaults to CACHE_DIR.
+        tag (str, optional): Name of the kind of arrays, to keep several entries per source file.
+
+    Returns:
+        tuple: (arrays, meta), with arrays a dict of read-only memory-mapped arrays and meta the dict
+        stored with them, or None when there is no valid entry for the current content of the file.
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    entry = entry_name(filename, cache_dir, tag)
+    if not exists(entry + '.json'):
+        return None
+    try:
+        with open(entry + '.json', 'r') as f:
+            header = json.load(f)
+        if header['source'] != file_key(filename):
+            return None
+        arrays = {name: np.load(entry + '.' + name + '.npy', mmap_mode = 'r') for name in header['arrays']}
+    except (OSError, ValueError, KeyError):
+        # an incomplete or corrupted entry is treated as a cache miss, it is overwritten when saving
+        return None
+
+    # mark the entry as recently used
+    os.utime(entry + '.json')
+    print('Loaded cached data of', filename)
+    return arrays, header['meta']
+
+
+def save_cache(filename, arrays, meta = None, cache_dir = None, max_size = None, tag = None, keep = ()):
+    """ Store the decoded arrays of a recording in the cache.
+
+    Every file is written under a temporary name and then moved into place, so memory-maps of an earlier
+    version of the entry stay valid. When a file cannot be replaced (e.g. on Windows, while it is still
+    memory-mapped), the arrays are not cached.
+
+    Args:
+        filename (str): Path of the source recording.
+        arrays (dict): Arrays to store, by name.
+        meta (dict, optional): JSON serializable information that is returned together with the arrays.
+        cache_dir (str, optional): Cache directory. Defaults to CACHE_DIR.
+        max_size (int, optional): Maximum total size of the cache directory in bytes. Defaults to CACHE_MAX_SIZE.
+        tag (str, optional): Name of the kind of arrays, to keep several entries per source file.
+        keep (list, optional): Other entries (see entry_name) that are in use and are not evicted.
+
+    Returns:
+        bool: True when the entry is stored.
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok = True)
+    entry = entry_name(filename, cache_dir, tag)
+    suffix = '.' + os.urandom(4).hex() + '.tmp' # temporary files are unique per writer
+
+    try:
+        # remove the header first, so an interrupted write never results in a valid entry
+        if exists(entry + '.json'):
+            os.remove(entry + '.json')
+        for name, array in arrays.items():
+            _replace(entry + '.' + name + suffix + '.npy', entry + '.' + name + '.npy', lambda f: np.save(f, np.ascontiguousarray(array)))
+        header = dict(source = file_key(filename), arrays = list(arrays), meta = {} if meta is None else meta)
+        _replace(entry + suffix + '.json', entry + '.json', lambda f: f.write(json.dumps(header, default = _to_json).encode('utf-8')))
+    except OSError as error:
+        print('Could not cache the data of', filename + ':', error)
+        return False
+
+    evict_cache(cache_dir, CACHE_MAX_SIZE if max_size is None else max_size, keep = [entry] + list(keep))
+    return True
+
+
+def _replace(temp_name, name, write):
+    # write a file under a temporary name and move it into place, the temporary file is removed when this fails
+    try:
+        with open(temp_name, 'wb') as f:
+            write(f)
+        os.replace(temp_name, name)
+    except OSError:
+        if exists(temp_name):
+            try:
+                os.remove(temp_name)
+            except OSError:
+                pass # removed by the eviction of a later call
+        raise
+
+
+def _file_size(filename):
+    # size of a file, 0 when it was removed in the meantime (e.g. by another process)
+    try:
+        return getsize(filename)
+    except OSError:
+        return 0
+
+
+def _to_json(value):
+    # numpy scalars and arrays in the stored information are converted to their python equivalent
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError('Object of type ' + type(value).__name__ + ' is not JSON serializable')
+
+
+def evict_cache(cache_dir = None, max_size = None, keep = ()):
+    """ Remove the least recently used entries until the cache directory is at most max_size bytes.
+
+    The entries in keep (see entry_name) are never removed. Files that cannot be removed (e.g. on Windows,
+    while they are memory-mapped) are skipped together with the rest of their entry.
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    max_size = CACHE_MAX_SIZE if max_size is None else max_size
+    if not exists(cache_dir):
+        return
+
+    # group the files of the cache entries per entry, any other file or directory is skipped
+    entries = {}
+    for name in os.listdir(cache_dir):
+        match = ENTRY_FILE.match(name)
+        if match is not None and os.path.isfile(join(cache_dir, name)):
+            entries.setdefault(join(cache_dir, match.group(1)), []).append(join(cache_dir, name))
+    total_size = sum(_file_size(f) for files in entries.values() for f in files)
+
+    # entries without a header are incomplete and are removed first, then the least recently used ones
+    last_used = lambda entry: os.path.getmtime(entry + '.json') if exists(entry + '.json') else -1
+    for entry in sorted(entries, key = last_used):
+        if total_size <= max_size:
+            break
+        if entry in keep:
+            continue
+        # the header is removed last, an entry that is still in use keeps its remaining files and is removed later
+        for f in sorted(entries[entry], key = lambda f: f.endswith('.json')):
+            try:
+                size = getsize(f)
+                os.remove(f)
+            except OSError:
+                break
+            total_size -= size
@@ -0,0 +1,108 @@
+'''
+Parallel loading of several recordings into signal dictionaries, with the fields of offline_EMG.convert_poly5_xdf.
+
+Every recording is parsed in a worker process, which stores the EMG data and the reference signals in the
+sidecar cache (see recording_cache). The main process loads them back as read-only memory-maps, so the
+samples are never pickled between the processes, and a recording that was loaded before is not parsed again.
+'''
+
+import numpy as np
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from reader_files.poly5_force_file_reader import Poly5Reader
+from reader_files.xdf_reader import Xdf_Reader
+from reader_files.recording_cache import CACHE_DIR, load_cache, save_cache, evict_cache, entry_name
+
+SIGNAL_TAG = 'signal_dict' # tag of the cache entries, to keep them apart from the cached samples of the readers
+REF_CHANNELS = dict(target = 'Force Profile', path = 'AUX 1-2') # reference signals and the names of their channels
+
+
+def load_signal_dicts(filepaths, grid_names = ['TMSi8-8-L'], muscle_names = ['BB'], ref_exist = 1, max_workers = None, cache_dir = None):
+    """ Load several .poly5/.xdf recordings concurrently into signal dictionaries.
+
+    Args:
+        filepaths (list): Paths of the .poly5 and .xdf files.
+        grid_names (list, optional): Names of the grids, the same for all recordings.
+        muscle_names (list, optional): Names of the muscles, the same for all recordings.
+        ref_exist (bool, optional): Add the target and path of the force profile, as offline_EMG.ref_exist.
+        max_workers (int, optional): Number of worker processes. Defaults to the number of processors.
+        cache_dir (str, optional): Cache directory that holds the parsed recordings. Defaults to CACHE_DIR.
+
+    Returns:
+        list: Per file a dict with the fields of offline_EMG.signal_dict (data, fsamp, nchans, ngrids, grids,
+        muscles, nsamples and with ref_exist target and path), the names of the EMG channels (ch_names) and the
+        filepath. The data, target and path are read-only memory-mapped arrays. Pass one to EMGDecomposition.run
+        (signal_dict) to decompose it without converting the file again.
+    """
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    unique_paths = list(dict.fromkeys(filepaths))
+
+    # Parse the recordings that are not cached yet, every worker only returns when its entry is stored
+    with ProcessPoolExecutor(max_workers = max_workers) as pool:
+        list(pool.map(_cache_signal, unique_paths, repeat(cache_dir)))
+
+    ngrids = len(grid_names)
+    signals = []
+    for filepath in filepaths:
+        cached = load_cache(filepath, cache_dir, SIGNAL_TAG)
+        if cached is None:
+            raise ValueError('The cached signal of ' + filepath + ' is not valid, the file changed while loading.')
+        arrays, meta = cached
+
+        signal = dict(data = arrays['data'], fsamp = meta['fsamp'], nchans = meta['nchans'], ngrids = ngrids, grids = grid_names[:ngrids], muscles = muscle_names[:ngrids])
+        signal['nsamples'] = meta['nsamples']
+        signal['ch_names'] = meta['ch_names']
+        if ref_exist:
+            if not all(key in arrays for key in REF_CHANNELS):
+                raise ValueError('File ' + filepath + ' has no Force Profile and AUX 1-2 channels for the reference.')
+            signal['path'] = arrays['path']
+            signal['target'] = arrays['target']
+        signal['filepath'] = filepath
+        signals.append(signal)
+
+    # The workers do not evict entries while others are still being written, the cache is bounded once all are loaded
+    evict_cache(cache_dir, keep = [entry_name(filepath, cache_dir, SIGNAL_TAG) for filepath in unique_paths])
+    return signals
+
+
+def read_signal(filepath):
+    """ Parse a .poly5/.xdf recording into the arrays and information of its signal dictionary.
+
+    Returns:
+        tuple: (arrays, meta), with arrays the EMG data (data) and, when the recording has them, the reference
+        signals (target and path), and meta the sample rate (fsamp), number of channels (nchans), number of
+        samples (nsamples) and the names of the EMG channels (ch_names).
+    """
+    if filepath.lower().endswith('poly5'):
+        # Only decode the EMG channels (all but the first and last three channels) and the reference channels
+        header = Poly5Reader(filepath, readAll = False)
+        header.close()
+        emg_ch_names = header.ch_names[1:-3]
+        ref_ch_names = [name for name in REF_CHANNELS.values() if name in header.ch_names]
+        data = Poly5Reader(filepath, channels = emg_ch_names + ref_ch_names)
+        samples, ch_names, sample_rate, num_channels = data.samples, data.ch_names, data.sample_rate, data.num_channels
+        emg_rows = slice(0, len(emg_ch_names))
+    elif filepath.lower().endswith('xdf'):
+        reader = Xdf_Reader(filepath, to_mne = False)
+        samples, ch_names, sample_rate = reader.data[0]
+        num_channels = len(ch_names)
+        emg_rows = slice(1, -3)
+    else:
+        raise ValueError('File format of ' + filepath + ' is not supported, only .poly5 and .xdf files can be loaded.')
+
+    arrays = dict(data = samples[emg_rows, :])
+    for key, name in REF_CHANNELS.items():
+        if name in ch_names:
+            # the reference signals are small, keep them in float64 for the plateau threshold
+            arrays[key] = samples[ch_names.index(name)].astype(np.float64)
+    meta = dict(fsamp = int(sample_rate), nchans = num_channels, nsamples = np.shape(samples)[1], ch_names = list(ch_names[emg_rows]))
+    return arrays, meta
+
+
+def _cache_signal(filepath, cache_dir):
+    # Worker: parse the recording and store its arrays in the cache, unless a valid entry exists
+    if load_cache(filepath, cache_dir, SIGNAL_TAG) is not None:
+        return
+    arrays, meta = read_signal(filepath)
+    save_cache(filepath, arrays, meta, cache_dir = cache_dir, max_size = np.inf, tag = SIGNAL_TAG)
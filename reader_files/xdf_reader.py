@@ -37,15 +37,29 @@ from tkinter import filedialog
 import numpy as np
 import pandas as pd
 import copy
-import locale
 
-from os.path import join, dirname, realpath
+from os.path import join, dirname, realpath, splitext
+from reader_files.recording_cache import load_cache, save_cache
+from reader_files.export import write_csv, write_columns
+from reader_files.live_impedance import expand_live_impedance
 Reader_dir = dirname(realpath(__file__)) # directory of this file
 modules_dir = join(Reader_dir, '../') # directory with all modules
 
 
 class Xdf_Reader: 
-    def __init__(self, filename=None, add_ch_locs=False):
+    def __init__(self, filename=None, add_ch_locs=False, channels=None, start=0, stop=None, cache=False, cache_dir=None, 
+                 select_streams=None, to_mne=True):
+        # channels (names or indices) and start/stop (in samples) restrict the data of every stream 
+        # before it is scaled and converted to MNE, channels that are not in a stream are skipped (a ValueError is raised 
+        # for channels that are in none of the streams)
+        # cache keeps the parsed streams in a sidecar cache (see recording_cache) in cache_dir, so that 
+        # reading the same file again only memory-maps them
+        # select_streams is a list of queries on the stream info, e.g. [{'type': 'EEG'}] or [{'name': 'SAGA'}], 
+        # only the streams that match one of them are decoded
+        # with to_mne=False no MNE objects are created, data then holds a (samples, ch_names, fsamp) tuple per stream, 
+        # with the scaled float32 (channels x samples) array. The exports and impedances work on these arrays, 
+        # ch_types, ch_units and impedances hold the MNE channel types, units and impedances of every stream, 
+        # in the order of the channels in data
         if filename==None:
             root = tk.Tk()
 
@@ -54,44 +68,64 @@ class Xdf_Reader:
             
         self.filename = filename
         self.add_ch_locs=add_ch_locs
+        self.selected_channels = channels
+        self.start = start
+        self.stop = stop
+        self.cache = cache
+        self.cache_dir = cache_dir
+        self.select_streams = select_streams
+        self.to_mne = to_mne
         print('Reading file ', filename)
         self.data, self.time_stamps = self._readFile(filename)
 
-    def export_to_csv(self):
-        data = self.data[0]
-        
-        # Extract samples, channel names and sample rate
-        samples = data.get_data(units = {'eeg':'uV'})
-        ch_names = data.ch_names
-        sample_rate = data.info['sfreq']
+    def export_to_csv(self, samples_per_chunk = None):
+        "Export the first stream to a .csv file next to the .xdf file, converting and writing samples_per_chunk samples at a time"
+        ch_names, sample_rate, num_samples, get_chunk = self._export_stream(0)
         
         # Add unit names to the column header
-        ch_names = [ch_names[i] + ' (' + self.stream_info[0]["desc"][0]["channels"][0]["channel"][i]["unit"][0] + ')' for i in range(len(ch_names))]
-        ch_names += ['Fs (Hz)']
-        
-        # Add Sample rate as a separate column to the samples vector
-        samples = np.vstack((samples, np.zeros((1,np.shape(samples)[1]))))
-        samples[-1,:] = sample_rate
-        
-        # Get decimal point representation (in local language settings)
-        langlocale = locale.getdefaultlocale()[0]
-        locale.setlocale(locale.LC_ALL, langlocale)
-        dp = locale.localeconv()['decimal_point']
+        ch_names = [ch_names[i] + ' (' + self.ch_units[0][i] + ')' for i in range(len(ch_names))]
         
-        # Write to dataframe
-        df = pd.DataFrame(data = samples.T, columns = ch_names)
-        # Export dataframe to .csv
+        # Export the samples, with the sample rate as a separate column, to .csv
         if self.filename.lower().endswith('.xdf'):
             save_name = self.filename.replace('.xdf', '.csv')
-            df.to_csv(path_or_buf = save_name, sep = ';', decimal = dp, index = False, encoding = 'utf-16')
+            write_csv(save_name, ch_names, get_chunk, num_samples, sample_rate, samples_per_chunk)
             print('Exported to .csv successfully')
         return
     
+    def export_to_npy(self, folder = None, samples_per_chunk = None):
+        """Export every channel of the first stream to a float32 .npy file with a manifest.json, that can be memory-mapped 
+        by other tools. EEG channels are exported in microvolts, as in export_to_csv.
+        
+        Args:
+            folder (str, optional): Output folder. Defaults to the file name of the recording with '_channels'.
+            samples_per_chunk (int, optional): Number of samples that are written at once.
+        """
+        ch_names, sample_rate, num_samples, get_chunk = self._export_stream(0)
+        if folder is None:
+            folder = splitext(self.filename)[0] + '_channels'
+        write_columns(folder, ch_names, self.ch_units[0], get_chunk, num_samples, sample_rate, source = self.filename, samples_per_chunk = samples_per_chunk)
+        print('Exported to ' + folder + ' successfully')
+        return
+    
+    def _export_stream(self, index):
+        # channel names, sample rate, number of samples and a get_chunk(start, stop) function of a stream, 
+        # with the EEG channels in microvolts, from the MNE object or (with to_mne=False) from the samples array
+        data = self.data[index]
+        if self.to_mne:
+            return data.ch_names, data.info['sfreq'], data.n_times, lambda start, stop: data.get_data(units = {'eeg':'uV'}, start = start, stop = stop)
+        samples, ch_names, fs = data
+        to_uV = np.array([1e6 if t == 'eeg' else 1 for t in self.ch_types[index]])[:, None]
+        return ch_names, fs, samples.shape[1], lambda start, stop: samples[:, start:stop] * to_uV
+    
     def _readFile(self, fname):
         try: 
-            streams, header = load_xdf(fname)
+            streams = self._loadStreams(fname)
             num_streams = len(streams)
             self.stream_info = {}
+            self.ch_types = {}
+            self.ch_units = {}
+            self.impedances = {}
+            self._check_channels([self._get_ch_info(stream)[0] for stream in streams])
             
             print('Number of streams in file: ' + str(num_streams))
             for i in range(num_streams):
@@ -101,48 +135,81 @@ class Xdf_Reader:
                   fs = float(stream["info"]["nominal_srate"][0])
                   labels, types, units, impedances = self._get_ch_info(stream)
                   
+                  # select the requested samples and channels (in the reordered grid order) before any conversion
+                  time_series = stream["time_series"][self.start:self.stop]
+                  time_stamps = stream['time_stamps'][self.start:self.stop]
+                  channel_idx = self._grid_order(labels)
+                  selected_idx = self._select_channels([labels[i] for i in channel_idx])
+                  if selected_idx is not None:
+                      channel_idx = channel_idx[selected_idx]
+                  if len(impedances) == len(labels):
+                      impedances = [impedances[i] for i in channel_idx]
+                  labels = [labels[i] for i in channel_idx]
+                  types = [types[i] for i in channel_idx]
+                  units = [units[i] for i in channel_idx]
+                  self.ch_types[i] = self._mne_types(types, units)
+                  self.ch_units[i] = units
+                  self.impedances[i] = impedances
+                  
                   # convert from microvolts to volts if necessary
                   scale = np.array([1e-6 if (u == "µVolt" or u == "uVolt" or u == '\u03BCVolt') else 1 for u in units])
-                  samples = (stream["time_series"] * scale).T
-                  samples, labels = self._reorder_grid(samples, labels)
-                  type_options=["ecg", "bio", "stim", "eog", "misc", "seeg", "dbs", "ecog", "mag", "eeg", "ref_meg", "grad", "emg", "hbr", "hbo"]
-                  for ind, t in enumerate(types):
-                      if t=="EEG":
-                          types[ind]="eeg"
-                      elif not t in type_options:
-                          if 'V' in units[ind]:
-                            types[ind] = 'eeg'
-                          else:  
-                            types[ind]="misc"
-                            
-                  info = mne.create_info(ch_names=labels, sfreq=fs, ch_types=types)   
-                  info=self._get_ch_locations(stream, info)
-                  if self.add_ch_locs:
-                      info=self._add_ch_locations(info)
-                 
-                  raw = mne.io.RawArray(samples, info)
-                  raw.impedances=impedances
                   
-                  if raw is not None:
-                      print(raw, end="\n\n")
-                      print(raw.info)
-                      
-                      if num_streams == 1:
-                          return (raw,), (stream['time_stamps'],)
+                  if not self.to_mne:
+                      # fast path: only select the channels (one copy) and scale them in place
+                      samples = np.ascontiguousarray(time_series.T[channel_idx], dtype = np.float32)
+                      samples *= np.expand_dims(scale, axis=1)
+                      stream_data = (samples, labels, fs)
+                      print('Read stream ' + str(i) + ': ' + str(len(labels)) + ' channels, ' + str(samples.shape[1]) + ' samples')
+                  else:
+                      stream_data = self._to_mne(stream, time_series, channel_idx, labels, types, units, scale, impedances, fs)
+                  
+                  if num_streams == 1:
+                      return (stream_data,), (time_stamps,)
+                  else:
+                      if i == 0:
+                          output_data = (copy.copy(stream_data),)
+                          output_timestamps = (copy.copy(time_stamps) - float(self.stream_info[i]['desc'][0]['synchronization'][0]['offset_mean'][0]) ,)
+                      elif i == num_streams - 1:
+                          output_data = output_data + (copy.copy(stream_data),)
+                          output_timestamps = output_timestamps + (copy.copy(time_stamps)  - float(self.stream_info[i]['desc'][0]['synchronization'][0]['offset_mean'][0]) ,)
+                          return output_data, output_timestamps
                       else:
-                          if i == 0:
-                              output_data = (copy.copy(raw),)
-                              output_timestamps = (copy.copy(stream['time_stamps']) - float(self.stream_info[i]['desc'][0]['synchronization'][0]['offset_mean'][0]) ,)
-                          elif i == num_streams - 1:
-                              output_data = output_data + (copy.copy(raw),)
-                              output_timestamps = output_timestamps + (copy.copy(stream['time_stamps'])  - float(self.stream_info[i]['desc'][0]['synchronization'][0]['offset_mean'][0]) ,)
-                              return output_data, output_timestamps
-                          else:
-                              output_data = output_data + (copy.copy(raw),)
-                              output_timestamps = output_timestamps + (copy.copy(stream['time_stamps'])  - float(self.stream_info[i]['desc'][0]['synchronization'][0]['offset_mean'][0]) ,)
+                          output_data = output_data + (copy.copy(stream_data),)
+                          output_timestamps = output_timestamps + (copy.copy(time_stamps)  - float(self.stream_info[i]['desc'][0]['synchronization'][0]['offset_mean'][0]) ,)
         except Exception as e:
             print('Reading data failed because of the following error:\n')
             raise
+    
+    def _to_mne(self, stream, time_series, channel_idx, labels, types, units, scale, impedances, fs):
+        # create the MNE RawArray of a stream, with the channel types and locations
+        samples = (time_series[:, channel_idx] * scale).T
+        types = self._mne_types(types, units)
+                  
+        info = mne.create_info(ch_names=labels, sfreq=fs, ch_types=types)   
+        info=self._get_ch_locations(stream, info, channel_idx)
+        if self.add_ch_locs:
+            info=self._add_ch_locations(info)
+       
+        raw = mne.io.RawArray(samples, info)
+        raw.impedances=impedances
+        
+        print(raw, end="\n\n")
+        print(raw.info)
+        return raw
+    
+    def _mne_types(self, types, units):
+        # MNE channel types of the channels, channels in Volt without an MNE type are EEG channels
+        type_options=["ecg", "bio", "stim", "eog", "misc", "seeg", "dbs", "ecog", "mag", "eeg", "ref_meg", "grad", "emg", "hbr", "hbo"]
+        types = list(types)
+        for ind, t in enumerate(types):
+            if t=="EEG":
+                types[ind]="eeg"
+            elif not t in type_options:
+                if 'V' in units[ind]:
+                  types[ind] = 'eeg'
+                else:  
+                  types[ind]="misc"
+        return types
             
     def add_impedances(self, imp_filename=None):
         """Add impedances from .txt-file """
@@ -155,13 +222,48 @@ class Xdf_Reader:
         imp_df = pd.read_csv(imp_filename, delimiter = "\t", header=None)    
         imp_df.columns=['ch_name', 'impedance', 'unit']
         
-        for ch in range(len(self.data[0].info['chs'])):
+        ch_names = self.data[0].ch_names if self.to_mne else self.data[0][1]
+        for ch in range(len(ch_names)):
             for i_ch in range(len(imp_df)):
-                if self.data[0].info['chs'][ch]['ch_name'] == imp_df['ch_name'][i_ch]:
+                if ch_names[ch] == imp_df['ch_name'][i_ch]:
                     impedances.append(imp_df['impedance'][i_ch])
                     
-        self.data[0].impedances = impedances
+        if self.to_mne:
+            self.data[0].impedances = impedances
+        self.impedances[0] = impedances
    
+    def _loadStreams(self, fname):
+        # load the streams from the cache when it holds a valid entry, otherwise parse the file
+        if self.cache:
+            cached = load_cache(fname, self.cache_dir)
+            if cached is not None:
+                arrays, meta = cached
+                return self._match_streams([dict(info = info, time_series = arrays['time_series_' + str(i)], 
+                                                 time_stamps = arrays['time_stamps_' + str(i)]) for i, info in enumerate(meta['info'])])
+        
+        if not self.cache:
+            streams, header = load_xdf(fname, select_streams = self.select_streams)
+            return streams
+        
+        # the cache holds all streams of the file, the selection is applied afterwards
+        streams, header = load_xdf(fname)
+        
+        # streams with string samples (e.g. markers) are not cached
+        if all(isinstance(stream['time_series'], np.ndarray) for stream in streams):
+            arrays = {}
+            for i, stream in enumerate(streams):
+                arrays['time_series_' + str(i)] = stream['time_series']
+                arrays['time_stamps_' + str(i)] = stream['time_stamps']
+            save_cache(fname, arrays, dict(info = [stream['info'] for stream in streams]), cache_dir = self.cache_dir)
+        return self._match_streams(streams)
+    
+    def _match_streams(self, streams):
+        # keep the streams of which the info matches all items of one of the queries in select_streams
+        if self.select_streams is None:
+            return streams
+        return [stream for stream in streams 
+                if any(all(stream['info'].get(key, [None])[0] == value for key, value in query.items()) for query in self.select_streams)]
+    
     def _get_ch_info(self, stream):
         # read channel labels, types, units and impedances
         labels, types, units, impedances = [], [], [], []
@@ -174,9 +276,36 @@ class Xdf_Reader:
                 impedances.append(str(ch["impedance"][0]))
         return labels, types, units, impedances
     
-    def _get_ch_locations(self, stream, info):
+    def _check_channels(self, stream_labels):
+        # the selected channel names and indices should be in at least one of the streams
+        if self.selected_channels is None:
+            return
+        for ch in self.selected_channels:
+            if isinstance(ch, str):
+                if not any(ch in labels for labels in stream_labels):
+                    raise ValueError('Channel ' + ch + ' is not present in the file.')
+            elif not any(-len(labels) <= ch < len(labels) for labels in stream_labels):
+                raise ValueError('Channel index ' + str(ch) + ' is not present in the file.')
+    
+    def _select_channels(self, labels):
+        # convert the selected channel names or indices to indices in the stream
+        if self.selected_channels is None:
+            return None
+        channel_idx = []
+        for ch in self.selected_channels:
+            if isinstance(ch, str):
+                if ch in labels:
+                    channel_idx.append(labels.index(ch))
+            elif -len(labels) <= ch < len(labels):
+                channel_idx.append(ch % len(labels))
+        return channel_idx
+    
+    def _get_ch_locations(self, stream, info, channel_idx=None):
         # read channel locations and convert unit from mm to m
-        for i, ch in enumerate(stream["info"]["desc"][0]["channels"][0]["channel"]):
+        channels = stream["info"]["desc"][0]["channels"][0]["channel"]
+        if channel_idx is not None:
+            channels = [channels[i] for i in channel_idx]
+        for i, ch in enumerate(channels):
             if ch["location"]:
                 info['chs'][i]['loc'][0]=float(ch["location"][0]["X"][0])*1e-3
                 info['chs'][i]['loc'][1]=float(ch["location"][0]["Y"][0])*1e-3
@@ -207,7 +336,7 @@ class Xdf_Reader:
         else:
             return None
         
-    def _reorder_grid(self, samples, ch_names):
+    def _grid_order(self, ch_names):
         # Reordering textile grid channels
         channel_conversion_list = np.arange(0,len(ch_names), dtype = int)
         
@@ -224,6 +353,11 @@ class Xdf_Reader:
         RCch.sort()
         for ch in range(len(RCch)):
             channel_conversion_list[ch] = RCch[ch][2]
+        
+        return channel_conversion_list
+    
+    def _reorder_grid(self, samples, ch_names):
+        channel_conversion_list = self._grid_order(ch_names)
             
         # Change the ordering of channels on the textile grid
         samples = samples[channel_conversion_list,:]
@@ -231,19 +365,20 @@ class Xdf_Reader:
         
         return samples, ch_names
     
-    def read_live_impedance(self):
+    def read_live_impedance(self, compact = False):
         """
         This function reads the live measured impedances that are stored in the 
         datafile. If no live impedances are stored in the file, the function will return before proceeding
         
+        :param compact: return the change-points per channel instead of (channels x samples) arrays, see live_impedance.expand_live_impedance
+        :type compact: bool
         :return live_imp: real part of the impedances for all channels
         :rtype: array
         :return live_cap: imaginary part of the impedances for all channels
         :rtype: array
     """
         # Parameters from class
-        samples = self.data[0].get_data()
-        ch_names = self.data[0].ch_names
+        ch_names = self.data[0].ch_names if self.to_mne else self.data[0][1]
         # Parameter to define if there are live impedances stored in file
         live_imp_in_file = False
 
@@ -272,29 +407,10 @@ class Xdf_Reader:
             live_cap = []
             return live_imp, live_cap
                 
-        # Cycle_idx channel defines the channel index of which the impedance information is stored in channels CYCL_ST1 and CYCL_ST2
-        # To find the amount of channels stored in the data, find the maximum value of the cycl_idx channel
-        maximum_cycl_idx = np.max(samples[cycl_idx_num,:])
-        
-        # Last index of the channel information is maximum_cylc_idx. So, channel indices range from 0 to this number. Therefore, length of stored info is one more (0 should be included)
-        length_stored_idx = int(maximum_cycl_idx+1)
-        
-        # cycl_idx channel stores the id of the channel of which the impedance is measured at that index
-        cycl_idx = samples[cycl_idx_num,:]
-        # cycl_imp stores the real part of the impedance value (resistance)
-        cycl_imp = samples[cycl_imp_num,:]
-        # cycl_cap stores the imaginary part of the impedance value (capacity)
-        cycl_cap = samples[cycl_cap_num,:]
-        
-        # Define the variables that store the live impedance and live cap per channel. By default, set the values to 1000
-        live_imp = np.ones((num_channels, len(samples[cycl_imp_num,:]))) * 1000
-        live_cap = np.ones((num_channels, len(samples[cycl_cap_num,:]))) * 1000
-        
-        
-        # Loop through the channels and store the values
-        for i in range(len(cycl_idx)):
-            # Values are measured once in every length_stored_idx channels, they are not updated for every sample
-            live_imp[int(cycl_idx[i]),i:i+length_stored_idx] = cycl_imp[i]
-            live_cap[int(cycl_idx[i]),i:i+length_stored_idx] = cycl_cap[i]
-
-        return live_imp[:,:], live_cap[:,:]
+        # Cycle_idx channel defines the channel index of which the impedance information is stored in channels CYCL_ST1 and CYCL_ST2,
+        # cycl_imp stores the real part of the impedance value (resistance) and cycl_cap the imaginary part (capacity)
+        if self.to_mne:
+            cycl_idx, cycl_imp, cycl_cap = self.data[0].get_data(picks = [cycl_idx_num, cycl_imp_num, cycl_cap_num])
+        else:
+            cycl_idx, cycl_imp, cycl_cap = self.data[0][0][[cycl_idx_num, cycl_imp_num, cycl_cap_num]].astype(np.float64)
+        return expand_live_impedance(cycl_idx, cycl_imp, cycl_cap, num_channels, compact)